@@ -0,0 +1,96 @@
+import hashlib
+import json
+import re
+
+try:
+    from beyblade_lambda import dates, metrics
+    from beyblade_lambda.constants import BEYBLADE_URL
+    from beyblade_lambda.encoding import available_encodings
+    from beyblade_lambda.lib import publish_artifact
+    from beyblade_lambda.wire import FLOAT_PRECISION, WIRE_VERSION, to_columnar
+except ModuleNotFoundError:
+    # To support running for local testing
+    import dates
+    import metrics
+    from constants import BEYBLADE_URL
+    from encoding import available_encodings
+    from lib import publish_artifact
+    from wire import FLOAT_PRECISION, WIRE_VERSION, to_columnar
+
+
+# Sources that list every county next to the state as a whole (a spec with `group_by`, see
+# engine.py) are read once and split into one series per area. Each area's series is published
+# in the columnar wire format as its own content addressed file, and an index lists them all so a
+# county page loads the index and its one area:
+#
+#   {"version": 1, "name": "epi", "statewide": "California", "wire_version": 1,
+#    "areas": {"Alameda": {"url", "update_time", "rows"}, ...}}
+AREAS_INDEX_VERSION = 1
+
+_SLUG_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def due(section, interval_days):
+    # Whether a run reads and publishes every area of the source whose metadata section this is:
+    # the first time, and then once the state's own series is `interval_days` past the areas'
+    # last update. Every other run only reads the state's own series, incrementally.
+    published = (section.get("areas") or {}).get("update_time")
+    return published is None or dates.add_days(published, interval_days) <= section["update_time"]
+
+
+def slug(area):
+    return _SLUG_PATTERN.sub("-", str(area).lower()).strip("-") or "none"
+
+
+def partition(rows, field):
+    # {value of field: [rows]} in one pass, rows keep their order within each area
+    groups = {}
+    for row in rows:
+        area = row[field]
+        group = groups.get(area)
+        if group is None:
+            group = groups[area] = []
+        group.append(row)
+    return groups
+
+
+def publish_areas(groups, name, config, statewide=None, date_fields=("date",), precision=FLOAT_PRECISION, debug=False):
+    # Publishes every area's series and the index pointing at them. Returns the metadata entry
+    # for the index, with the keys of every area's file so garbage collection keeps them.
+    index = {
+        "version": AREAS_INDEX_VERSION,
+        "name": name,
+        "statewide": statewide,
+        "wire_version": WIRE_VERSION,
+        "areas": {},
+    }
+    keys = []
+    for area in sorted(groups, key=str):
+        records = groups[area]
+        if not records:
+            continue
+        with metrics.timer("serialize"):
+            columnar_str = json.dumps(
+                to_columnar(records, date_fields=date_fields, precision=precision), separators=(",", ":")
+            ).encode("utf-8")
+        key = config.get_processed_area_key(name, slug(area), WIRE_VERSION, hashlib.md5(columnar_str).hexdigest())
+        if not debug:
+            publish_artifact(columnar_str, key)
+        keys.append(key)
+        index["areas"][area] = {
+            "url": f"{BEYBLADE_URL.rstrip('/')}/{key}",
+            "update_time": records[-1]["date"],
+            "rows": len(records),
+        }
+
+    index_str = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    index_key = config.get_processed_areas_index_key(name, hashlib.md5(index_str).hexdigest())
+    if not debug:
+        publish_artifact(index_str, index_key)
+    metrics.add("upload", Areas=len(keys))
+    return {
+        "url": f"{BEYBLADE_URL.rstrip('/')}/{index_key}",
+        "version": AREAS_INDEX_VERSION,
+        "encodings": available_encodings(),
+        "keys": keys,
+    }
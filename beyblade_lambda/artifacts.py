@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+
+try:
+    from beyblade_lambda.constants import BEYBLADE_URL, CONTENT_ADDRESSED_KEY_PATTERN
+    from beyblade_lambda.encoding import SUFFIXES
+    from beyblade_lambda.storage import get_storage
+except ModuleNotFoundError:
+    # To support running for local testing
+    from constants import BEYBLADE_URL, CONTENT_ADDRESSED_KEY_PATTERN
+    from encoding import SUFFIXES
+    from storage import get_storage
+
+
+# Content addressed artifacts have the md5 of their body in the key, so a key that exists never
+# needs writing again and only the artifacts metadata.json points at are ever read. Everything
+# else is removed by collect_garbage once it is older than the grace period, which covers
+# metadata.json/index.json still cached by CloudFront and browsers and runs still in flight.
+GC_GRACE_DAYS = 7
+ARTIFACT_KEY_PATTERN = CONTENT_ADDRESSED_KEY_PATTERN
+
+
+def url_to_key(url):
+    return url[len(BEYBLADE_URL.rstrip("/")) + 1:]
+
+
+def exists(key, storage=None):
+    # HEAD only, the body is never transferred
+    return (storage or get_storage()).head(key) is not None
+
+
+def put_artifact(key, body, content_type, storage=None, **extra):
+    # Returns True if the artifact was written, False if it already existed
+    storage = storage or get_storage()
+    if exists(key, storage):
+        return False
+    storage.put(key, body, content_type, **extra)
+    return True
+
+
+def _variant_keys(key, encodings):
+    return [key] + [f"{key}{SUFFIXES[e]}" for e in encodings or [] if e in SUFFIXES]
+
+
+def _section_keys(section):
+    keys = []
+    for entry in (section, section.get("columnar"), section.get("areas")):
+        if entry and entry.get("url"):
+            keys.extend(_variant_keys(url_to_key(entry["url"]), entry.get("encodings")))
+    # Every area's series (see areas.py), next to the index
+    for key in (section.get("areas") or {}).get("keys") or []:
+        keys.extend(_variant_keys(key, section["areas"].get("encodings")))
+    if section.get("archive"):
+        keys.extend([section["archive"], f"{section['archive']}.md5"])
+    return keys
+
+
+def referenced_keys(metadata):
+    keys = []
+    # Every source section and the bundle
+    for section in metadata.values():
+        if isinstance(section, dict):
+            keys.extend(_section_keys(section))
+    return sorted(set(keys))
+
+
+def collect_garbage(config, metadata, grace_days=GC_GRACE_DAYS, dry_run=True, storage=None, now=None):
+    # Deletes the state's artifacts that metadata doesn't reference and that are older than
+    # grace_days. Returns a report of what was (or with dry_run, would be) deleted.
+    storage = storage or get_storage()
+    referenced = set(referenced_keys(metadata))
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=grace_days)
+
+    scanned, recent, unreferenced, freed = 0, 0, [], 0
+    for prefix in config.get_artifact_prefixes():
+        for obj in storage.list(prefix):
+            if not ARTIFACT_KEY_PATTERN.search(obj["Key"]):
+                continue
+            scanned += 1
+            if obj["Key"] in referenced:
+                continue
+            if obj.get("LastModified") is None or obj["LastModified"] > cutoff:
+                recent += 1
+                continue
+            unreferenced.append(obj["Key"])
+            freed += obj.get("Size") or 0
+
+    if unreferenced and not dry_run:
+        storage.delete(unreferenced)
+    return {
+        "state": config.state,
+        "dry_run": dry_run,
+        "scanned": scanned,
+        "referenced": len(referenced),
+        "within_grace_period": recent,
+        "unreferenced": unreferenced,
+        "bytes_freed": freed,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    try:
+        from beyblade_lambda.config import StorageConfig
+        from beyblade_lambda.lib import get_processed_data
+        from beyblade_lambda.runner import STATES
+    except ModuleNotFoundError:
+        from config import StorageConfig
+        from lib import get_processed_data
+        from runner import STATES
+
+    parser = argparse.ArgumentParser(description="Remove artifacts no metadata.json references")
+    parser.add_argument("states", nargs="*", default=list(STATES))
+    parser.add_argument("--grace-days", type=float, default=GC_GRACE_DAYS)
+    parser.add_argument("--execute", action="store_true", help="delete; without it only report")
+    args = parser.parse_args()
+    for state in args.states:
+        config = StorageConfig(state)
+        metadata = get_processed_data(config.get_processed_metadata_key())
+        if metadata is None:
+            # Without metadata everything would look unreferenced
+            print(json.dumps({"state": state, "error": "no metadata.json, skipped"}))
+            continue
+        report = collect_garbage(config, metadata, grace_days=args.grace_days, dry_run=not args.execute)
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,554 @@
+import contextlib
+import copy
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from datetime import date, datetime, timedelta
+
+try:
+    from beyblade_lambda import areas, ca, ca_constants, cache, engine, lib, runner, storage, wa, wa_constants, wire
+    from beyblade_lambda.encoding import compression_report
+    from beyblade_lambda.fetch import ConditionalFetch, get_session
+    from beyblade_lambda.reports import parse_report
+except ModuleNotFoundError:
+    # To support running for local testing
+    import areas
+    import ca
+    import ca_constants
+    import cache
+    import engine
+    import lib
+    import runner
+    import storage
+    import wa
+    import wa_constants
+    import wire
+    from encoding import compression_report
+    from fetch import ConditionalFetch, get_session
+    from reports import parse_report
+
+
+# Offline benchmarks of every pipeline stage. Sources are replayed from fixture files through a
+# transport mounted on the fetch session and S3 is a LocalStorage in a temporary directory, so
+# nothing touches the network. Fixtures are either recorded from the real sources (`record`) or
+# generated (`synthesize`, optionally scaled to 10x/100x the rows to expose superlinear stages).
+#
+#   python -m beyblade_lambda.bench record fixtures/
+#   python -m beyblade_lambda.bench run --fixtures fixtures/ --output bench.json
+#   python -m beyblade_lambda.bench run --scale 1 10 100 --baseline bench.json
+SOURCES = {
+    "ca_epi": (ca_constants.EPI_DATA_URL, "ca_epi.csv"),
+    "ca_breakthrough": (ca_constants.BREAKTHROUGH_DATA_URL, "ca_breakthrough.csv"),
+    "wa_epi": (wa_constants.EPI_DATA_URL, "wa_epi.xlsx"),
+    "wa_breakthrough": (wa_constants.BREAKTHROUGH_DATA_URL, "wa_breakthrough.pdf"),
+}
+MANIFEST_FNAME = "manifest.json"
+REPORTS_DIR = "wa_reports"
+# A stage is reported as a regression when it is this much slower than the baseline
+REGRESSION_THRESHOLD = 1.25
+
+SYNTHETIC_DAYS = 700
+SYNTHETIC_BREAKTHROUGH_DAYS = 300
+SYNTHETIC_REPORTS = 8
+SYNTHETIC_START = date(2020, 3, 1)
+
+
+## Fixtures ##
+
+def _write_manifest(fixtures_dir, reports, origin):
+    manifest = {
+        "origin": origin,
+        "created": int(time.time()),
+        "sources": {name: fname for name, (_, fname) in SOURCES.items()},
+        "reports": reports,
+    }
+    with open(os.path.join(fixtures_dir, MANIFEST_FNAME), "w") as fs:
+        json.dump(manifest, fs, indent=2)
+    return manifest
+
+
+def load_fixtures(fixtures_dir):
+    # {"manifest": ..., "sources": {name: bytes}, "reports": {fname: bytes}}
+    with open(os.path.join(fixtures_dir, MANIFEST_FNAME)) as fs:
+        manifest = json.load(fs)
+    fixtures = {"manifest": manifest, "sources": {}, "reports": {}}
+    for name, fname in manifest["sources"].items():
+        with open(os.path.join(fixtures_dir, fname), "rb") as fs:
+            fixtures["sources"][name] = fs.read()
+    for fname in manifest["reports"]:
+        with open(os.path.join(fixtures_dir, REPORTS_DIR, fname), "rb") as fs:
+            fixtures["reports"][fname] = fs.read()
+    return fixtures
+
+
+def record_fixtures(fixtures_dir, max_reports=SYNTHETIC_REPORTS):
+    # Downloads every source plus the most recent archived WA reports from the real bucket
+    os.makedirs(os.path.join(fixtures_dir, REPORTS_DIR), exist_ok=True)
+    for name, (url, fname) in SOURCES.items():
+        content = ConditionalFetch(url).content()
+        with open(os.path.join(fixtures_dir, fname), "wb") as fs:
+            fs.write(content)
+
+    s3 = storage.get_storage()
+    report_keys = [
+        obj["Key"] for obj in s3.list(wa.CONFIG.get_breakthrough_data_prefix()) if obj["Key"].endswith("pdf")
+    ][-max_reports:]
+    reports = []
+    for key in report_keys:
+        fname = key.rsplit("/", 1)[-1]
+        with open(os.path.join(fixtures_dir, REPORTS_DIR, fname), "wb") as fs:
+            fs.write(s3.get(key))
+        reports.append(fname)
+    return _write_manifest(fixtures_dir, reports, "recorded")
+
+
+def _csv_bytes(header, rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+def _synthetic_ca_epi(days):
+    areas = [ca_constants.EPI_AREA_OF_INTEREST, "Alameda", "Los Angeles", "Sacramento", "San Diego"]
+    rows = [["None", area, "Statewide", 0, 37] for area in areas]
+    for i in range(days):
+        day = (SYNTHETIC_START + timedelta(days=i)).isoformat()
+        rows.extend([day, area, "County", 100 + i % 50, (i * 7) % 90] for area in areas)
+    return _csv_bytes(["date", "area", "area_type", "cases", "reported_deaths"], rows)
+
+
+def _synthetic_ca_breakthrough(days):
+    rows = []
+    for i in range(days):
+        day = (SYNTHETIC_START + timedelta(days=300 + i)).isoformat()
+        rows.append([day, ca_constants.BREAKTHROUGH_AREA_OF_INTEREST, 1000 + i, i % 13, i % 5])
+    return _csv_bytes(["date", "area", "unvaccinated_deaths", "vaccinated_deaths", "boosted_deaths"], rows)
+
+
+def _synthetic_wa_epi(days):
+    # Only needed to write the fixture; the pipeline itself reads it with xlsx.read_sheet_records
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(wa_constants.EPI_DEATHS_WORKSHEET_NAME)
+    sheet.append(wa_constants.EPI_COLUMNS)
+    for i in range(days):
+        day = datetime.combine(SYNTHETIC_START + timedelta(days=i), datetime.min.time())
+        for county in (wa_constants.EPI_COUNTY_OF_INTEREST, "King", "Pierce", "Spokane"):
+            sheet.append([day, county, i % 40, (i % 40) / 7])
+    out = io.BytesIO()
+    workbook.save(out)
+    return out.getvalue()
+
+
+def _pdf_bytes(pages):
+    # Minimal PDF with one Helvetica text line per line of each page's text
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = len(pages) * 2 + 2
+    page_ids = []
+    for text in pages:
+        lines = []
+        for line in text.split("\n"):
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            lines.append(f"({escaped}) Tj T*")
+        stream = ("BT /F1 10 Tf 12 TL 50 750 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent %d 0 R /Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R "
+            b"/MediaBox [0 0 612 792] >>" % (pages_id, len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode("latin-1")
+    objects.append(b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids))
+    catalog = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objects.append(catalog)
+
+    out, offsets = b"%PDF-1.4\n", []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % (i + 1) + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    return out
+
+
+def _synthetic_wa_report(i):
+    report_date = date(2021, 6, 2) + timedelta(weeks=i)
+    end_date = report_date - timedelta(days=10)
+    fmt = lambda d: f"{d:%B} {d.day}, {d.year}"
+    filler = "\n".join(f"Table {n}: breakthrough cases by age group and county" for n in range(40))
+    pages = [
+        f"SARS-CoV-2 Vaccine Breakthrough Surveillance and Case Information Resource\n"
+        f"Washington State Department of Health {fmt(report_date)}\n{filler}",
+        f"At a Glance (data from January 17, 2021 - {fmt(end_date)})\n"
+        f"So far, {3000 + 450 * i:,} SARS-CoV-2 vaccine breakthrough cases have been identified\n"
+        f"Of these, 7% were hospitalized\n"
+        f"and {40 + 6 * i} people died of COVID-related illness\n{filler}",
+        filler,
+        filler,
+    ]
+    fname = wa_constants.BREAKTHROUGH_REPORT_FNAME_TMPL.format(date=report_date.isoformat())
+    return fname, _pdf_bytes(pages)
+
+
+def synthesize_fixtures(fixtures_dir, scale=1):
+    # Writes fixtures shaped like the real sources, with scale times the days (and reports)
+    os.makedirs(os.path.join(fixtures_dir, REPORTS_DIR), exist_ok=True)
+    reports = [_synthetic_wa_report(i) for i in range(SYNTHETIC_REPORTS * scale + 1)]
+    contents = {
+        "ca_epi": _synthetic_ca_epi(SYNTHETIC_DAYS * scale),
+        "ca_breakthrough": _synthetic_ca_breakthrough(SYNTHETIC_BREAKTHROUGH_DAYS * scale),
+        "wa_epi": _synthetic_wa_epi(SYNTHETIC_DAYS * scale),
+        # The latest report is the one currently published, the rest are archived
+        "wa_breakthrough": reports[-1][1],
+    }
+    for name, (_, fname) in SOURCES.items():
+        with open(os.path.join(fixtures_dir, fname), "wb") as fs:
+            fs.write(contents[name])
+    for fname, content in reports[:-1]:
+        with open(os.path.join(fixtures_dir, REPORTS_DIR, fname), "wb") as fs:
+            fs.write(content)
+    return _write_manifest(fixtures_dir, [fname for fname, _ in reports[:-1]], f"synthetic x{scale}")
+
+
+## Replay ##
+
+def _replay_adapter(content):
+    from requests.adapters import BaseAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+
+    class ReplayAdapter(BaseAdapter):
+        # Answers every request with the fixture, honouring If-None-Match like the real servers
+        def send(self, request, **kwargs):
+            resp = Response()
+            resp.request, resp.url = request, request.url
+            not_modified = request.headers.get("If-None-Match") == etag
+            resp.status_code, resp.reason = (304, "Not Modified") if not_modified else (200, "OK")
+            body = b"" if not_modified else content
+            resp.headers = CaseInsensitiveDict({"ETag": etag, "Content-Length": str(len(body))})
+            resp.raw = io.BytesIO(body)
+            return resp
+
+        def close(self):
+            pass
+
+    return ReplayAdapter()
+
+
+@contextlib.contextmanager
+def replay_sources(fixtures):
+    session = get_session()
+    for name, (url, _) in SOURCES.items():
+        session.mount(url, _replay_adapter(fixtures["sources"][name]))
+    try:
+        yield
+    finally:
+        for url, _ in SOURCES.values():
+            session.adapters.pop(url, None)
+
+
+@contextlib.contextmanager
+def use_cache(tiered_cache):
+    # get_cache() returns `tiered_cache` for the duration (False disables the cache)
+    cache.set_cache(tiered_cache)
+    try:
+        yield tiered_cache
+    finally:
+        cache.set_cache(None)
+
+
+@contextlib.contextmanager
+def local_storage(fixtures=None):
+    # Fresh LocalStorage for the duration, seeded with the archived WA reports, and an empty cache
+    # so cold runs download everything
+    root = tempfile.mkdtemp(prefix="beyblade-bench-")
+    local = storage.set_storage(storage.LocalStorage(os.path.join(root, "bucket")))
+    try:
+        with use_cache(cache.TieredCache(os.path.join(root, "cache"))):
+            for fname, content in (fixtures or {}).get("reports", {}).items():
+                local.put(f"{wa.CONFIG.get_breakthrough_data_prefix().rstrip('/')}/{fname}", content, "application/pdf")
+            yield local
+    finally:
+        # The next get_storage() goes back to the environment's storage
+        storage.set_storage(None)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+## Measurement ##
+
+def peak_memory_kib(func):
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, repeat=3, memory=True):
+    # Times func() `repeat` times, then runs it once more under tracemalloc for the peak memory
+    # (tracemalloc slows everything down, so it never overlaps the timed runs).
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    stats = {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+    }
+    if memory:
+        stats["peak_kib"] = peak_memory_kib(func)
+    return stats, result
+
+
+def _serialize(records, date_fields=("date",)):
+    records_str = json.dumps(records).encode("utf-8")
+    columnar_str = json.dumps(wire.to_columnar(records, date_fields=date_fields), separators=(",", ":")).encode("utf-8")
+    return records_str, columnar_str
+
+
+def _upload(serialized):
+    def upload():
+        # Fresh storage every time so no artifact is skipped as already existing
+        with local_storage():
+            for i, body in enumerate(serialized):
+                lib.publish_artifact(body, f"bench/artifact_{i}.json")
+    return upload
+
+
+def _source(state, name):
+    return next(spec for spec in state.STATE["sources"] if spec["name"] == name)
+
+
+def _bench_series(results, name, parse, derive, repeat, date_fields=("date",)):
+    results[f"{name}.parse"], (_, records) = measure(parse, repeat)
+    results[f"{name}.parse"]["rows"] = len(records)
+    results[f"{name}.derive"], _ = measure(lambda: derive(copy.deepcopy(records)), repeat)
+    results[f"{name}.serialize"], serialized = measure(lambda: _serialize(records, date_fields), repeat)
+    results[f"{name}.serialize"]["bytes"] = sum(len(s) for s in serialized)
+    # Every encoding publish_artifact stores next to each artifact and the bytes it saves
+    results[f"{name}.compress"], compression = measure(
+        lambda: [compression_report(s) for s in serialized], repeat, memory=False
+    )
+    results[f"{name}.compress"].update(zip(("records", "columnar"), compression))
+    results[f"{name}.upload"], _ = measure(_upload(serialized), repeat)
+
+
+def _bench_areas(results, name, state, repeat):
+    # Every county's series from one read ("parse_areas") and their derived columns and files
+    # ("publish_areas"), next to the statewide-only parse
+    spec = next(spec for spec in state.STATE["sources"] if spec.get("group_by"))
+    def parse():
+        area_series = {}
+        _, records = engine.refresh_series(spec, fetch=ConditionalFetch(spec["url"]), areas=area_series)
+        area_series[spec["filters"][spec["group_by"]]] = records
+        return area_series
+
+    results[f"{name}.parse_areas"], area_series = measure(parse, repeat)
+    results[f"{name}.parse_areas"]["areas"] = len(area_series)
+    results[f"{name}.parse_areas"]["rows"] = sum(len(s) for s in area_series.values())
+
+    def publish(debug=True):
+        groups = copy.deepcopy(area_series)
+        for series in groups.values():
+            spec["derive"](series)
+        return areas.publish_areas(groups, spec["name"], state.CONFIG, debug=debug)
+
+    results[f"{name}.publish_areas"], _ = measure(publish, repeat)
+
+    # What the encodings save over every area's file together
+    with local_storage() as local:
+        compression = [compression_report(local.get(key)) for key in publish(debug=False)["keys"]]
+    total = {k: sum(report[k] for report in compression) for k in compression[0] if k != "saved"}
+    total["saved"] = {e: sum(report["saved"][e] for report in compression) for e in compression[0]["saved"]}
+    results[f"{name}.publish_areas"]["files"] = total
+
+
+def _bench_reports(results, name, spec, parse, reports, repeat):
+    # Parse time of each report on its own
+    timings = [measure(lambda: parse(report), repeat, memory=False)[0]["median_ms"] for report in reports]
+    pages = [engine.extractor(spec).extract(report)[2] for report in reports]
+    results[f"{name}.parse_report"] = {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "reports": len(reports),
+        "pages_read": round(statistics.mean(pages), 1),
+    }
+
+
+def bench_stages(fixtures, repeat=3):
+    results = {}
+    with replay_sources(fixtures), use_cache(False):
+        for name, (url, _) in SOURCES.items():
+            results[f"{name}.replay"], content = measure(lambda: ConditionalFetch(url).content(), repeat)
+            results[f"{name}.replay"]["bytes"] = len(content)
+
+    # A forced refresh in a warm container: the source answers 304 and the body is read from /tmp
+    with replay_sources(fixtures), tempfile.TemporaryDirectory(prefix="beyblade-cache-") as cache_dir:
+        with use_cache(cache.TieredCache(cache_dir, memory_bytes=0)):
+            for name, (url, _) in SOURCES.items():
+                ConditionalFetch(url).content()
+                results[f"{name}.replay_cached"], _ = measure(lambda: ConditionalFetch(url, force=True).content(), repeat)
+
+    with replay_sources(fixtures), use_cache(False):
+        # The CSV sources are parsed while they stream, so their parse includes the (in memory) replay
+        for name, state in (("ca_epi", ca), ("ca_breakthrough", ca), ("wa_epi", wa)):
+            spec = _source(state, name.split("_")[1])
+            _bench_series(
+                results, name,
+                lambda: engine.refresh_hook(spec)(debug=True, fetch=ConditionalFetch(spec["url"])),
+                lambda records: engine.publish(state.STATE, spec, records, debug=True), repeat
+            )
+        _bench_areas(results, "ca_epi", ca, repeat)
+        _bench_areas(results, "wa_epi", wa, repeat)
+
+    reports = list(fixtures["reports"].values()) + [fixtures["sources"]["wa_breakthrough"]]
+
+    def parse_reports():
+        records = sorted((parse_report(wa._process_breakthrough_report, r) for r in reports), key=lambda r: r["report_date"])
+        return records[-1]["report_date"], records
+
+    _bench_series(
+        results, "wa_breakthrough", parse_reports,
+        lambda records: engine.publish(wa.STATE, _source(wa, "breakthrough"), records, debug=True), repeat,
+        date_fields=wa_constants.BREAKTHROUGH_DATE_FIELDS
+    )
+    results["wa_breakthrough.parse"]["reports"] = len(reports)
+    _bench_reports(results, "wa_breakthrough", wa_constants.BREAKTHROUGH_SOURCE, wa._process_breakthrough_report, reports, repeat)
+
+    return results
+
+
+def bench_full_run(fixtures):
+    # runner.main against an empty bucket (every source new) and then again (every source 304)
+    results = {}
+    with replay_sources(fixtures), local_storage(fixtures):
+        for run in ("cold", "warm"):
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[f"runner.main.{run}"], summary = measure(lambda: runner.main(), repeat=1, memory=False)
+            results[f"runner.main.{run}"]["states"] = {s: r["elapsed"] for s, r in summary.items()}
+    # Peak memory of a cold run on its own, with the states one after the other
+    with replay_sources(fixtures), local_storage(fixtures):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["runner.main.cold"]["peak_kib"] = peak_memory_kib(lambda: runner.main(concurrent=False))
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # [{"stage", "baseline_ms", "ms", "ratio", "regressed"}] for every stage in both
+    comparisons = []
+    for stage, stats in results.items():
+        if stage not in baseline or not baseline[stage].get("median_ms"):
+            continue
+        ratio = stats["median_ms"] / baseline[stage]["median_ms"]
+        comparisons.append({
+            "stage": stage,
+            "baseline_ms": baseline[stage]["median_ms"],
+            "ms": stats["median_ms"],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > threshold,
+        })
+    return comparisons
+
+
+def run_benchmarks(fixtures_dir=None, scales=(1,), repeat=3, full=True):
+    # {"<fixtures label>": {stage: stats}}. Without recorded fixtures, synthetic ones are
+    # generated for every scale.
+    reports = {}
+    if fixtures_dir:
+        labelled = [("recorded", fixtures_dir)]
+    else:
+        labelled = [(f"synthetic_x{scale}", None) for scale in scales]
+    for label, directory in labelled:
+        tmp = None
+        if directory is None:
+            tmp = directory = tempfile.mkdtemp(prefix="beyblade-fixtures-")
+            synthesize_fixtures(directory, scale=int(label.rsplit("x", 1)[1]))
+        try:
+            fixtures = load_fixtures(directory)
+            reports[label] = bench_stages(fixtures, repeat=repeat)
+            if full:
+                reports[label].update(bench_full_run(fixtures))
+        finally:
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+    return reports
+
+
+def format_report(reports, comparisons=None):
+    lines = []
+    for label, results in reports.items():
+        lines.append(f"== {label} ==")
+        for stage, stats in results.items():
+            extra = " ".join(
+                f"{k}={json.dumps(v, separators=(',', ':')) if isinstance(v, dict) else v}"
+                for k, v in stats.items() if k not in ("median_ms", "min_ms", "peak_kib")
+            )
+            lines.append(
+                f"{stage:<32} {stats['median_ms']:>11.3f} ms {stats.get('peak_kib', ''):>10} KiB  {extra}"
+            )
+        for c in (comparisons or {}).get(label, []):
+            flag = "REGRESSED" if c["regressed"] else ""
+            lines.append(f"  {c['stage']:<30} {c['baseline_ms']:>11.3f} -> {c['ms']:.3f} ms x{c['ratio']} {flag}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the pipeline stages")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="record fixtures from the real sources")
+    record.add_argument("fixtures")
+    record.add_argument("--reports", type=int, default=SYNTHETIC_REPORTS)
+    synthesize = commands.add_parser("synthesize", help="write synthetic fixtures")
+    synthesize.add_argument("fixtures")
+    synthesize.add_argument("--scale", type=int, default=1)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--fixtures", help="recorded fixtures; synthetic ones are generated without")
+    run.add_argument("--scale", type=int, nargs="+", default=[1], help="synthetic fixture scales, e.g. 1 10 100")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--no-full", dest="full", action="store_false", help="skip timing runner.main")
+    run.add_argument("--output", help="write the results as JSON, e.g. to use as a baseline")
+    run.add_argument("--baseline", help="results JSON from an earlier run to compare with")
+    run.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(json.dumps(record_fixtures(args.fixtures, max_reports=args.reports), indent=2))
+    elif args.command == "synthesize":
+        print(json.dumps(synthesize_fixtures(args.fixtures, scale=args.scale), indent=2))
+    else:
+        reports = run_benchmarks(args.fixtures, scales=args.scale, repeat=args.repeat, full=args.full)
+        comparisons = None
+        if args.baseline:
+            with open(args.baseline) as fs:
+                baseline = json.load(fs)
+            comparisons = {
+                label: compare(results, baseline.get(label, {}), threshold=args.threshold)
+                for label, results in reports.items()
+            }
+        print(format_report(reports, comparisons))
+        if args.output:
+            with open(args.output, "w") as fs:
+                json.dump(reports, fs, indent=2)
+        if comparisons and any(c["regressed"] for cs in comparisons.values() for c in cs):
+            sys.exit(1)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+
+try:
+    from beyblade_lambda.artifacts import url_to_key
+    from beyblade_lambda.config import StorageConfig
+    from beyblade_lambda.constants import BEYBLADE_URL, METADATA_CACHE_CONTROL, PROCESSED_INDEX_KEY
+    from beyblade_lambda.encoding import available_encodings
+    from beyblade_lambda.lib import get_processed_data, publish_artifact
+    from beyblade_lambda.storage import get_storage
+except ModuleNotFoundError:
+    # To support running for local testing
+    from artifacts import url_to_key
+    from config import StorageConfig
+    from constants import BEYBLADE_URL, METADATA_CACHE_CONTROL, PROCESSED_INDEX_KEY
+    from encoding import available_encodings
+    from lib import get_processed_data, publish_artifact
+    from storage import get_storage
+
+
+# A bundle is everything the site shows for one state (labels plus both series in the columnar
+# wire format) in one content addressed file, and the index points at every state's bundle, so
+# the site needs at most two requests to render a state.
+BUNDLE_VERSION = 1
+INDEX_VERSION = 1
+SECTIONS = ("epi", "breakthrough")
+
+
+def build_bundle(metadata, sections=SECTIONS):
+    bundle = {
+        "version": BUNDLE_VERSION,
+        "state_label": metadata["state_label"],
+        "human_label": metadata["human_label"],
+    }
+    for section in sections:
+        columnar = metadata[section].get("columnar")
+        # Data published before the columnar format existed can't be bundled yet
+        if not columnar:
+            return None
+        data = get_processed_data(url_to_key(columnar["url"]))
+        if data is None:
+            return None
+        bundle[section] = {"update_time": metadata[section]["update_time"], "data": data}
+    return bundle
+
+
+def publish_state_bundle(metadata, config, sections=SECTIONS):
+    # Sets metadata["bundle"] and returns True when a bundle was published
+    bundle = build_bundle(metadata, sections)
+    if bundle is None:
+        return False
+    bundle_str = json.dumps(bundle, separators=(",", ":")).encode("utf-8")
+    bundle_key = config.get_processed_bundle_key(BUNDLE_VERSION, hashlib.md5(bundle_str).hexdigest())
+    publish_artifact(bundle_str, bundle_key)
+    metadata["bundle"] = {
+        "url": f"{BEYBLADE_URL.rstrip('/')}/{bundle_key}",
+        "version": BUNDLE_VERSION,
+        "encodings": available_encodings(),
+    }
+    return True
+
+
+def build_index(states):
+    index = {"version": INDEX_VERSION, "states": {}}
+    for state in states:
+        config = StorageConfig(state)
+        metadata = get_processed_data(config.get_processed_metadata_key())
+        if metadata is None:
+            continue
+        index["states"][state] = {
+            "state_label": metadata["state_label"],
+            "human_label": metadata["human_label"],
+            "metadata_url": f"{BEYBLADE_URL.rstrip('/')}/{config.get_processed_metadata_key()}",
+            "bundle": metadata.get("bundle"),
+        }
+    return index
+
+
+def publish_index(states):
+    # Returns True if the index changed (and so needs invalidating)
+    index_str = json.dumps(build_index(states), sort_keys=True).encode("utf-8")
+    storage = get_storage()
+    if storage.get(PROCESSED_INDEX_KEY) == index_str:
+        return False
+    storage.put(PROCESSED_INDEX_KEY, index_str, "application/json", CacheControl=METADATA_CACHE_CONTROL)
+    return True
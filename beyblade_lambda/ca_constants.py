@@ -1,21 +1,55 @@
 ## EPI DATA CONSTANTS ##
 EPI_DATA_URL = "https://data.chhs.ca.gov/dataset/f333528b-4d38-4814-bebb-12db1f10f535/resource/046cdd2b-31e5-4d34-9ed3-b48cdbc4be7a/download/covid19cases_test.csv"
 EPI_AREA_OF_INTEREST = "California"
+# Number of days before the latest published day that are re-parsed on every run, since CDPH
+# keeps revising recent days as death certificates come in.
+EPI_REVISION_LOOKBACK_DAYS = 30
+# Reading every county means building and dating every row of the source instead of only the
+# state's, so the county series are refreshed on a cadence rather than on every new day.
+EPI_AREAS_INTERVAL_DAYS = 7
 
-EPI_COLUMNS = [
-    "date",
-    "area",
-    "reported_deaths",
-]
+EPI_COLUMNS = {
+    "date": "date",
+    "area": "area",
+    "reported_deaths": "deaths",
+}
+
+# See engine.py for what each key means
+EPI_SOURCE = {
+    "name": "epi",
+    "type": "csv",
+    "url": EPI_DATA_URL,
+    "columns": EPI_COLUMNS,
+    "filters": {"area": EPI_AREA_OF_INTEREST},
+    # Every county's series is published too, from the same read every EPI_AREAS_INTERVAL_DAYS
+    "group_by": "area",
+    "areas_interval_days": EPI_AREAS_INTERVAL_DAYS,
+    "date_field": "date",
+    "date_format": "%Y-%m-%d",
+    "types": {"deaths": "int"},
+    "incremental": True,
+    "splice_fields": ("date", "deaths"),
+    "lookback_days": EPI_REVISION_LOOKBACK_DAYS,
+}
 
 ## BREAKTHROUGH DATA CONSTANTS ##
 
 BREAKTHROUGH_DATA_URL = "https://data.chhs.ca.gov/dataset/e39edc8e-9db1-40a7-9e87-89169401c3f5/resource/c5978614-6a23-450b-b637-171252052214/download/covid19postvaxstatewidestats.csv"
 BREAKTHROUGH_AREA_OF_INTEREST = "California"
 
-BREAKTHROUGH_COLUMNS = [
-    "date",
-    "area",
-    "vaccinated_deaths",
-    "boosted_deaths",
-]
+BREAKTHROUGH_COLUMNS = {
+    "date": "date",
+    "area": "area",
+    "vaccinated_deaths": "vaccinated_deaths",
+    "boosted_deaths": "boosted_deaths",
+}
+
+BREAKTHROUGH_SOURCE = {
+    "name": "breakthrough",
+    "type": "csv",
+    "url": BREAKTHROUGH_DATA_URL,
+    "columns": BREAKTHROUGH_COLUMNS,
+    "date_field": "date",
+    "date_format": "%Y-%m-%d",
+    "types": {"vaccinated_deaths": "int", "boosted_deaths": "int"},
+}
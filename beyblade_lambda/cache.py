@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+try:
+    from beyblade_lambda import metrics
+except ModuleNotFoundError:
+    # To support running for local testing
+    import metrics
+
+
+# A two tier cache for what a run downloads: an in-process LRU in front of a size bounded LRU in
+# a directory on /tmp. Lambda keeps both the process and /tmp of a warm container between
+# invocations, so repeated runs are mostly served locally. Every entry has a `version` (the S3
+# ETag or the source's validators) that the caller checks against the origin, so stale entries
+# are never served; see storage.CachedStorage and fetch.ConditionalFetch.
+#
+#   cache = get_cache()
+#   cache.put("s3:bucket/key", body, etag)
+#   body, etag = cache.get("s3:bucket/key") or (None, None)
+MEMORY_MAX_BYTES = 64 * 1024 * 1024
+DISK_MAX_BYTES = 256 * 1024 * 1024
+# Larger entries would push out everything else, so they are only kept by the disk tier (if they
+# fit in it) or not at all
+MEMORY_MAX_ENTRY_FRACTION = 0.25
+DISK_MAX_ENTRY_FRACTION = 0.25
+# Set to a directory to keep the disk tier there, or to "off" to disable the cache altogether
+CACHE_DIR_ENV = "BEYBLADE_CACHE_DIR"
+DEFAULT_CACHE_DIR = "/tmp/beyblade-cache"
+READ_CHUNK_SIZE = 64 * 1024
+
+STATS = ("MemoryHits", "DiskHits", "Misses", "Stores", "Invalidations", "Evictions", "Stale")
+
+
+class _DiskWriter:
+    # Streams an entry straight to disk, for bodies that are parsed while they download
+    def __init__(self, cache, key, version):
+        self._cache = cache
+        self._key = key
+        self._version = version
+        self._path = f"{cache._path(key)}.{threading.get_ident()}.tmp"
+        self._fs = open(self._path, "wb")
+        self.size = 0
+
+    def write(self, chunk):
+        if self._fs is None:
+            return
+        self.size += len(chunk)
+        if self.size > self._cache.disk_bytes * DISK_MAX_ENTRY_FRACTION:
+            self.abort()
+            return
+        self._fs.write(chunk)
+
+    def commit(self, version=None):
+        # `version` replaces the one given up front, e.g. validators that include the body's md5
+        if self._fs is None:
+            return
+        self._fs.close()
+        self._fs = None
+        self._cache._commit_disk(self._key, version or self._version, self._path, self.size)
+
+    def abort(self):
+        if self._fs is not None:
+            self._fs.close()
+            self._fs = None
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+
+class TieredCache:
+    def __init__(self, directory=None, memory_bytes=MEMORY_MAX_BYTES, disk_bytes=DISK_MAX_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # Entry file name -> size, least recently used first. Loaded from the directory on first
+        # use, since a warm container may already have entries from an earlier process.
+        self._disk = None
+        self._disk_size = 0
+        self._lock = threading.RLock()
+        self._stats = dict.fromkeys(STATS, 0)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+        metrics.add("cache", **{name: n})
+
+    def stats(self, reset=False):
+        with self._lock:
+            stats = dict(self._stats)
+            if reset:
+                self._stats = dict.fromkeys(STATS, 0)
+        lookups = stats["MemoryHits"] + stats["DiskHits"] + stats["Misses"]
+        stats["HitRate"] = round((stats["MemoryHits"] + stats["DiskHits"]) / lookups, 3) if lookups else None
+        stats["MemoryBytes"], stats["DiskBytes"] = self._memory_size, self._disk_size
+        return stats
+
+    ## Memory tier ##
+
+    def _memory_put(self, key, body, version):
+        self._memory_drop(key)
+        if len(body) > self.memory_bytes * MEMORY_MAX_ENTRY_FRACTION:
+            return
+        self._memory[key] = (body, version)
+        self._memory_size += len(body)
+        while self._memory_size > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._count("Evictions")
+
+    def _memory_drop(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[0])
+
+    ## Disk tier ##
+
+    def _name(self, key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, self._name(key))
+
+    def _load_disk(self):
+        # Callers hold the lock
+        if self._disk is not None:
+            return
+        self._disk = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith(".tmp"):
+                # Left behind by a process that died mid write
+                os.remove(os.path.join(self.directory, fname))
+            elif fname.endswith(".json"):
+                path = os.path.join(self.directory, fname[:-len(".json")])
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, fname[:-len(".json")], stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+
+    def _disk_drop(self, name):
+        size = self._disk.pop(name, None)
+        if size is None:
+            return False
+        self._disk_size -= size
+        for path in (os.path.join(self.directory, name), os.path.join(self.directory, f"{name}.json")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def _commit_disk(self, key, version, tmp_path, size):
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            self._load_disk()
+            self._disk_drop(name)
+            os.replace(tmp_path, path)
+            # The entry only exists once its metadata is written
+            with open(f"{path}.json.tmp", "w") as fs:
+                json.dump({"key": key, "version": version, "size": size}, fs)
+            os.replace(f"{path}.json.tmp", f"{path}.json")
+            self._disk[name] = size
+            self._disk_size += size
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                self._disk_drop(next(iter(self._disk)))
+                self._count("Evictions")
+        self._count("Stores")
+
+    def _disk_meta(self, key):
+        name = self._name(key)
+        if name not in self._disk:
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{name}.json")) as fs:
+                meta = json.load(fs)
+        except (FileNotFoundError, ValueError):
+            self._disk_drop(name)
+            return None
+        return meta if meta["key"] == key else None
+
+    ## Interface ##
+
+    def version(self, key):
+        # The version of the cached entry without reading its body, or None
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key][1]
+            if self.directory is None:
+                return None
+            self._load_disk()
+            meta = self._disk_meta(key)
+            return meta["version"] if meta else None
+
+    def get(self, key):
+        # (body, version) or None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                entry = self._memory[key]
+                tier = "MemoryHits"
+            elif self.directory is not None:
+                self._load_disk()
+                entry, tier = None, "Misses"
+                meta = self._disk_meta(key)
+                if meta is not None:
+                    name = self._name(key)
+                    path = os.path.join(self.directory, name)
+                    with open(path, "rb") as fs:
+                        entry = (fs.read(), meta["version"])
+                    # Most recently used; the mtime keeps the order for the next process
+                    os.utime(path)
+                    self._disk.move_to_end(name)
+                    self._memory_put(key, *entry)
+                    tier = "DiskHits"
+            else:
+                entry, tier = None, "Misses"
+        self._count(tier)
+        return entry
+
+    def iter_chunks(self, key, chunk_size=READ_CHUNK_SIZE):
+        # Yields the body of an entry in chunks, without reading a large disk entry into memory
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            self._count("MemoryHits")
+            body = entry[0]
+            for i in range(0, len(body), chunk_size):
+                yield body[i:i + chunk_size]
+            return
+        path = self._path(key) if self.directory is not None else None
+        if path is None or self.version(key) is None:
+            self._count("Misses")
+            return
+        try:
+            fs = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted since its version was read
+            self._count("Misses")
+            return
+        self._count("DiskHits")
+        os.utime(fs.fileno())
+        with fs:
+            while True:
+                chunk = fs.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def put(self, key, body, version):
+        if self.directory is None or len(body) > self.disk_bytes * DISK_MAX_ENTRY_FRACTION:
+            with self._lock:
+                self._memory_put(key, body, version)
+            self._count("Stores")
+            return
+        writer = self.writer(key, version)
+        writer.write(body)
+        writer.commit()
+        with self._lock:
+            self._memory_put(key, body, version)
+
+    def writer(self, key, version):
+        # Returns an object with write(chunk), commit() and abort(); the entry replaces any cached
+        # one on commit. Memory only caches have nothing to stream to, so the writer is None.
+        if self.directory is None:
+            return None
+        with self._lock:
+            self._load_disk()
+            self._memory_drop(key)
+        return _DiskWriter(self, key, version)
+
+    def invalidate(self, key, stale=False):
+        # Drops the entry from both tiers, e.g. when the origin has a newer version (stale) or
+        # when we write a new one
+        with self._lock:
+            dropped = key in self._memory
+            self._memory_drop(key)
+            if self.directory is not None:
+                self._load_disk()
+                dropped = self._disk_drop(self._name(key)) or dropped
+        if dropped:
+            self._count("Stale" if stale else "Invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self.directory is not None:
+                self._load_disk()
+                for name in list(self._disk):
+                    self._disk_drop(name)
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    # None when the cache is disabled
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                directory = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+                _CACHE = False if directory == "off" else TieredCache(directory or None)
+    return _CACHE or None
+
+
+def set_cache(cache):
+    # Pass False to disable the cache; with None the next get_cache() goes back to the environment's
+    global _CACHE
+    _CACHE = cache
+    return cache
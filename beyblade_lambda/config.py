@@ -6,20 +6,46 @@ class StorageConfig:
     def state(self):
         return self._state
 
+    def get_archive_prefix(self, source):
+        # Where the records of a source are archived as read (see engine.archive_records)
+        return f"static/{source}/{self.state}/"
+
     def get_epi_data_prefix(self):
-        return "static/epi/{self.state}/"
+        return self.get_archive_prefix("epi")
 
     def get_breakthrough_data_prefix(self):
         return f"static/reports/{self.state}/"
 
+    def get_breakthrough_manifest_key(self):
+        return f"{self.get_breakthrough_data_prefix().rstrip('/')}/manifest.json"
+
     def get_processed_data_prefix(self):
         return f"static/data/{self.state}"
 
+    def get_artifact_prefixes(self):
+        # Where the content addressed artifacts garbage collection looks after live
+        return [f"{self.get_processed_data_prefix()}/", self.get_epi_data_prefix()]
+
     def get_processed_metadata_key(self):
         return f"{self.get_processed_data_prefix()}/metadata.json"
 
+    def get_processed_series_key(self, name, md5):
+        return f"{self.get_processed_data_prefix()}/{name}_{md5}.json"
+
     def get_processed_epi_data_key(self, md5):
-        return f"{self.get_processed_data_prefix()}/epi_{md5}.json"
+        return self.get_processed_series_key("epi", md5)
 
     def get_processed_breakthrough_data_key(self, md5):
-        return f"{self.get_processed_data_prefix()}/breakthrough_{md5}.json"
+        return self.get_processed_series_key("breakthrough", md5)
+
+    def get_processed_bundle_key(self, version, md5):
+        return f"{self.get_processed_data_prefix()}/bundle_v{version}_{md5}.json"
+
+    def get_processed_columnar_key(self, name, version, md5):
+        return f"{self.get_processed_data_prefix()}/{name}_c{version}_{md5}.json"
+
+    def get_processed_area_key(self, name, area, version, md5):
+        return f"{self.get_processed_data_prefix()}/areas/{name}_{area}_c{version}_{md5}.json"
+
+    def get_processed_areas_index_key(self, name, md5):
+        return f"{self.get_processed_data_prefix()}/{name}_areas_{md5}.json"
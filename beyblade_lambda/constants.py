@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import re
+
 import pytz
 
 
@@ -11,3 +13,12 @@ BEYBLADE_URL = "https://beybla.de"
 # meh... it's not a password.
 
 CLOUDFRONT_DISTRIBUTION = "E28YRVB5CTBVQT"
+
+# Data files are content addressed (the md5 is in the key) so they never change once written
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_ADDRESSED_KEY_PATTERN = re.compile(r"[._][0-9a-f]{32}\.json(\.gz|\.br|\.md5)?$")
+# Lists every state and points at its bundle
+PROCESSED_INDEX_KEY = "static/data/index.json"
+
+# metadata.json and index.json point at the latest data files so it can only be cached briefly
+METADATA_CACHE_CONTROL = "public, max-age=300"
@@ -0,0 +1,68 @@
+import threading
+
+from datetime import datetime, timedelta
+
+try:
+    from beyblade_lambda.constants import AMERICA_PACIFIC
+except ModuleNotFoundError:
+    # To support running for local testing
+    from constants import AMERICA_PACIFIC
+
+
+# Sources date their rows with calendar days in the state's local time, published as the unix
+# timestamp of that day's local midnight. The same few hundred dates repeat across every row (the
+# CA csv has one row per county and day), so each distinct value is only parsed and localized
+# once per process. Timestamps come from the zone's own offsets, never the host's (time.mktime
+# would read the day in the Lambda's TZ), so the result is the same wherever it runs.
+#
+#   convert = converter("%Y-%m-%d")
+#   convert("2021-07-01")  # 1625122800, 2021-07-01T00:00-07:00
+_MEMOS = {}
+_MEMOS_LOCK = threading.Lock()
+
+
+def _memo(tz, date_format):
+    key = (tz.zone, date_format)
+    memo = _MEMOS.get(key)
+    if memo is None:
+        with _MEMOS_LOCK:
+            memo = _MEMOS.setdefault(key, {})
+    return memo
+
+
+def _localize(value, tz, date_format):
+    # `value` is a string in date_format, or a naive datetime (e.g. an xlsx date) without one
+    dt = datetime.strptime(value, date_format) if date_format else value
+    return int(tz.localize(dt).timestamp())
+
+
+def converter(date_format=None, tz=AMERICA_PACIFIC):
+    # Returns a function of one value to its timestamp, for row by row parsing
+    memo = _memo(tz, date_format)
+
+    def convert(value):
+        try:
+            return memo[value]
+        except KeyError:
+            ts = memo[value] = _localize(value, tz, date_format)
+            return ts
+    return convert
+
+
+def to_timestamp(value, date_format=None, tz=AMERICA_PACIFIC):
+    return converter(date_format, tz)(value)
+
+
+def to_day(ts, tz=AMERICA_PACIFIC):
+    # The calendar day a timestamp falls on in the zone
+    return datetime.fromtimestamp(ts, tz).date()
+
+
+def day_timestamp(day, tz=AMERICA_PACIFIC):
+    # Inverse of to_day: the timestamp of the day's midnight in the zone
+    return _localize(datetime(day.year, day.month, day.day), tz, None)
+
+
+def add_days(ts, days, tz=AMERICA_PACIFIC):
+    # Midnight `days` calendar days later (or earlier), which isn't always days * 24 hours away
+    return day_timestamp(to_day(ts, tz) + timedelta(days=days), tz)
@@ -0,0 +1,53 @@
+import gzip
+import importlib
+import importlib.util
+
+
+# Published artifacts are stored once as-is and once per encoding below, at "<key><suffix>" with
+# the matching Content-Encoding, so the site can fetch a pre-compressed copy. Brotli is optional
+# and only used when the brotli package is installed.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+SUFFIXES = {
+    "gzip": ".gz",
+    "br": ".br",
+}
+
+
+def available_encodings():
+    encodings = ["gzip"]
+    if importlib.util.find_spec("brotli") is not None:
+        encodings.append("br")
+    return encodings
+
+
+def encode(data, encoding):
+    if encoding == "gzip":
+        # mtime=0 so the same data always compresses to the same bytes
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br":
+        return importlib.import_module("brotli").compress(data, quality=BROTLI_QUALITY)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def encoded_key(key, encoding):
+    return f"{key}{SUFFIXES[encoding]}"
+
+
+def compression_report(data, encodings=None):
+    # {"identity": bytes, "<encoding>": bytes, ..., "saved": {"<encoding>": bytes saved}}
+    report = {"identity": len(data)}
+    for encoding in encodings or available_encodings():
+        report[encoding] = len(encode(data, encoding))
+    report["saved"] = {e: report["identity"] - n for e, n in report.items() if e != "identity"}
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # Reports the bytes saved for each published artifact file given on the command line
+    for path in sys.argv[1:]:
+        with open(path, "rb") as fs:
+            print(json.dumps({"artifact": path, **compression_report(fs.read())}))
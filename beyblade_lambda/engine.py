@@ -0,0 +1,387 @@
+import functools
+import hashlib
+import json
+import zipfile
+
+from io import BytesIO
+from pprint import pprint
+
+try:
+    from beyblade_lambda import areas, bundle, dates, incremental, metrics, series
+    from beyblade_lambda.artifacts import put_artifact
+    from beyblade_lambda.exceptions import ParseError
+    from beyblade_lambda.fetch import ConditionalFetch, stream_csv_records
+    from beyblade_lambda.lib import get_processed_data, publish_series, upload_metadata, invalidate_cloudfront_paths
+    from beyblade_lambda.pdf import FieldExtractor
+    from beyblade_lambda.storage import get_storage
+    from beyblade_lambda.xlsx import read_sheet_records
+except ModuleNotFoundError:
+    # To support running for local testing
+    import areas
+    import bundle
+    import dates
+    import incremental
+    import metrics
+    import series
+    from artifacts import put_artifact
+    from exceptions import ParseError
+    from fetch import ConditionalFetch, stream_csv_records
+    from lib import get_processed_data, publish_series, upload_metadata, invalidate_cloudfront_paths
+    from pdf import FieldExtractor
+    from storage import get_storage
+    from xlsx import read_sheet_records
+
+
+# Every state is a list of declarative source specs read by this one engine, so parsing,
+# publishing and the run loop are shared and a new state only declares its sources plus the hooks
+# that are particular to it. A spec is a dict:
+#
+#   name         section of metadata.json the source publishes to ("epi", "breakthrough")
+#   type         "csv", "xlsx" or "pdf"
+#   url          where the source is fetched from
+#   columns      csv/xlsx: header text -> field name; only these columns are read
+#   sheet        xlsx: worksheet name
+#   filters      csv/xlsx: field name -> value rows must have (e.g. the area of interest)
+#   date_field   csv/xlsx: field converted to a timestamp, read with date_format (csv) or as an
+#                excel serial date (xlsx); values in null_values become None (undated rows)
+#   types        csv/xlsx: field name -> "int" or "float"
+#   group_by     csv/xlsx: field the rows of every area (county) are grouped on in a single read
+#                (see areas.py). filters[group_by] then names the state's own series, every other
+#                area gets its series' derived columns from the `derive` hook. Reading every area
+#                costs a full read of the source, so it is only done every areas_interval_days
+#                (see areas.due); other runs read the state's own series alone
+#   fields       pdf: field name -> pattern, with `required` groups (see pdf.FieldExtractor)
+#   report_fname pdf: template with {date} the reports are archived under (see reports.py), with
+#                manifest_version
+#   incremental  the published series is spliced into instead of rebuilt, re-reading
+#                lookback_days before its last day. splice_fields are the fields read from the
+#                source, a record is revised when any of them differs from the published one
+#   archive      {"fields": [...], "fname": template with {md5}}: the records as read are kept
+#   date_fields  timestamp fields of the published records, published as day offsets
+#   cost         relative cost of a run, defaults to TYPE_COSTS[type]. A state's cost in
+#                runner.STATES is the sum over its sources (state_cost)
+#
+# and one of these hooks to read the source:
+#
+#   series       csv/xlsx: function of one area's rows (and the previous series, for an
+#                incremental source) returning its series, see refresh_series
+#   reports      pdf: the state's reports.ReportArchive
+#   refresh      anything else: function(debug, force_refresh, fetch, load_previous) returning
+#                (update_time, records), or (None, None) when the source hasn't changed
+#
+# `derive` adds the derived columns to a series before it is published, e.g. derive_cumulative.
+TYPE_COSTS = {
+    "csv": 1,
+    "xlsx": 2,
+    "pdf": 4,
+}
+DEFAULT_NULL_VALUES = ("", "None")
+
+_CASTS = {
+    "int": lambda v: int(float(v or 0)),
+    "float": lambda v: float(v or 0),
+}
+
+
+def source_cost(spec):
+    return spec.get("cost", TYPE_COSTS[spec["type"]])
+
+
+def state_cost(state):
+    return sum(source_cost(spec) for spec in state["sources"])
+
+
+def _read_csv(spec, fetch):
+    columns = spec["columns"]
+    by_field = {field: column for column, field in columns.items()}
+    filters = {by_field[k]: v for k, v in (spec.get("filters") or {}).items()}
+    for row in stream_csv_records(spec["url"], list(columns), filters=filters, fetch=fetch):
+        yield {columns[k]: v for k, v in row.items()}
+
+
+def _read_xlsx_openpyxl(content, spec):
+    # Only imported when needed, openpyxl is by far the slowest import of the lambda
+    import openpyxl
+
+    xlsx_data = BytesIO(content)
+    xlsx = openpyxl.load_workbook(xlsx_data, True)
+    worksheet = xlsx[spec["sheet"]]
+
+    # There is something broken about some of these spreadsheets and they are read in w/o
+    # dimensional information. To fix the issue we need to reset dimensions and then recalculate them.
+    # See: related: https://foss.heptapod.net/openpyxl/openpyxl/-/issues/1611
+    worksheet.reset_dimensions()
+    worksheet.calculate_dimension(force=True)
+    filters = list((spec.get("filters") or {}).items())
+    column_map = {}
+    rows = []
+    for row in worksheet.values:
+        if not column_map:
+            for i, value in enumerate(row):
+                if value in spec["columns"]:
+                    column_map[spec["columns"][value]] = i
+        elif all(row[column_map[k]] == v for k, v in filters):
+            rows.append({field: row[i] for field, i in column_map.items()})
+    return rows
+
+
+def _read_xlsx(spec, fetch):
+    content = fetch.content()
+    if content is None:
+        return []
+    date_fields = (spec["date_field"],) if spec.get("date_field") else ()
+    try:
+        # Fast path: stream just the worksheet's XML and only convert the mapped columns
+        return list(read_sheet_records(
+            content, spec["sheet"], spec["columns"], filters=spec.get("filters"), date_fields=date_fields
+        ))
+    except (ParseError, KeyError, ValueError, zipfile.BadZipFile) as ex:
+        print(f"Falling back to openpyxl to read {spec['url']}: {ex!r}")
+        return _read_xlsx_openpyxl(content, spec)
+
+
+_READERS = {
+    "csv": _read_csv,
+    "xlsx": _read_xlsx,
+}
+
+
+def read_records(spec, fetch=None, since=None):
+    # Yields {field: value} for every row of a csv or xlsx source that matches its filters, with
+    # the date field as a timestamp (None for undated rows) and typed fields cast. With `since`
+    # dated rows before it are dropped before anything else is converted; it can be a function
+    # returning the cut-off (or None), only called once the first row has been read. Nothing is
+    # yielded when the source hasn't changed, check fetch.unchanged once the records have been read.
+    fetch = fetch or ConditionalFetch(spec["url"])
+    date_field = spec.get("date_field")
+    convert_date = dates.converter(spec.get("date_format"))
+    null_values = spec.get("null_values", DEFAULT_NULL_VALUES)
+    casts = [(field, _CASTS[kind]) for field, kind in (spec.get("types") or {}).items()]
+    for row in _READERS[spec["type"]](spec, fetch):
+        if callable(since):
+            since = since()
+        if date_field:
+            value = row[date_field]
+            if value is None or value in null_values:
+                row[date_field] = None
+            else:
+                row[date_field] = convert_date(value)
+                if since is not None and row[date_field] < since:
+                    continue
+        for field, cast in casts:
+            row[field] = cast(row[field])
+        yield row
+
+
+def read_grouped(spec, fetch=None, since=None):
+    # {area: [rows]} for every area of a group_by source, in one pass over the source (see
+    # read_records). The area filter is the only one that isn't applied. `since` only cuts the
+    # state's own series (filters[group_by]), every other area is read in full.
+    field = spec["group_by"]
+    filters = {k: v for k, v in (spec.get("filters") or {}).items() if k != field}
+    groups = areas.partition(read_records(dict(spec, filters=filters), fetch=fetch), field)
+    if callable(since):
+        since = since() if groups else None
+    own = spec["filters"][field]
+    if since is not None and own in groups:
+        date_field = spec["date_field"]
+        groups[own] = [row for row in groups[own] if row[date_field] is None or row[date_field] >= since]
+    return groups
+
+
+def refresh_series(spec, debug=False, force_refresh=False, fetch=None, load_previous=None, areas=None):
+    # The refresh of a source with a `series` hook. With `load_previous` (see
+    # incremental.previous_loader) only rows inside the revision look-back window are kept, and they
+    # are spliced into the last published series. With `areas` (a dict) every other area's series is
+    # added to it from the same read of the source.
+    fetch = fetch or ConditionalFetch(spec["url"])
+    since = incremental.lazy_cutoff(load_previous, spec["lookback_days"]) if spec.get("incremental") else None
+    if areas is None:
+        # Rows of every other area are dropped while reading, before any record is built
+        rows, groups = list(read_records(spec, fetch=fetch, since=since)), {}
+    else:
+        groups = read_grouped(spec, fetch=fetch, since=since)
+        rows = groups.pop(spec["filters"][spec["group_by"]], [])
+    if fetch.unchanged:
+        return None, None
+
+    records = spec["series"](rows, load_previous() if load_previous else None)
+    if areas is not None:
+        for area, area_rows in groups.items():
+            areas[area] = spec["series"](area_rows)
+    return records[-1]["date"], records
+
+
+def derive_cumulative(records, field="deaths"):
+    # Adds cumulative_<field>. Records spliced in from the previously published series already
+    # have their cumulative value.
+    start = series.first_missing(records, f"cumulative_{field}")
+    initial = records[start - 1][f"cumulative_{field}"] if start else 0
+    cumulative = series.cumulative(series.column(records[start:], field), initial=initial)
+    series.assign(records, f"cumulative_{field}", cumulative, start=start)
+    return records
+
+
+def extractor(spec):
+    return FieldExtractor(spec["fields"], required=spec.get("required"))
+
+
+def extract_fields(spec, content):
+    # Returns {field: match groups} for a pdf source; parsing errors bubble up
+    fields, _, _ = extractor(spec).extract(content)
+    return fields
+
+
+def archive_records(config, spec, records, debug=False):
+    # Archives the series as read from the source, without any derived columns, and returns the
+    # key of the archive
+    archive = spec["archive"]
+    records_str = json.dumps([{k: r[k] for k in archive["fields"]} for r in records]).encode("utf-8")
+    records_md5 = hashlib.md5(records_str).hexdigest()
+    records_fname = archive["fname"].format(md5=records_md5)
+    records_data_key = f"{config.get_archive_prefix(spec['name']).strip('/')}/{records_fname}"
+
+    if not debug and put_artifact(records_data_key, records_str, "application/json"):
+        get_storage().put(f"{records_data_key}.md5", records_md5.encode("utf-8"), "text/plain")
+    return records_data_key
+
+
+def publish(state, spec, records, debug=False):
+    # Adds the derived columns and publishes the series, returns the fields of its metadata section
+    config = state["config"]
+    if spec.get("derive"):
+        records = spec["derive"](records)
+    return publish_series(
+        records, spec["name"], functools.partial(config.get_processed_series_key, spec["name"]), config,
+        date_fields=spec.get("date_fields", ("date",)), debug=debug
+    )
+
+
+def refresh_hook(spec):
+    if spec.get("refresh"):
+        return spec["refresh"]
+    if spec.get("reports"):
+        return spec["reports"].refresh
+    return functools.partial(refresh_series, spec)
+
+
+def get_metadata(state):
+    config = state["config"]
+    metadata = get_processed_data(config.get_processed_metadata_key())
+    if metadata is None:
+        metadata = {}
+    # Left behind by earlier versions, garbage collection reads the sources themselves
+    metadata.pop("artifacts", None)
+    for spec in state["sources"]:
+        metadata.setdefault(spec["name"], {"update_time": 0, "url": None})
+    metadata["state_label"] = state["state_label"]
+    metadata["human_label"] = state["human_label"]
+    return metadata
+
+
+def _run_source(state, spec, metadata, debug=False, force_refresh=False, incremental_series=True):
+    # Returns (records, updated, fetch). Sources that haven't changed since the last run are
+    # neither parsed nor processed.
+    config, section = state["config"], metadata[spec["name"]]
+    fetch = ConditionalFetch(spec["url"], section.get("source"), force=force_refresh)
+    # The previous series is only downloaded once the hook finds that the source has changed
+    load_previous = None
+    if spec.get("incremental") and incremental_series and not force_refresh:
+        load_previous = incremental.previous_loader(section)
+
+    # When they are due, the refresh hook of a group_by source fills in every other area's series
+    area_series = None
+    if spec.get("group_by") and (force_refresh or areas.due(section, spec["areas_interval_days"])):
+        area_series = {}
+    kwargs = {"areas": area_series} if area_series is not None else {}
+
+    with metrics.timer("parse"):
+        update_time, records = refresh_hook(spec)(
+            debug=debug, force_refresh=force_refresh, fetch=fetch, load_previous=load_previous, **kwargs
+        )
+    if records is not None and spec.get("archive"):
+        with metrics.timer("upload"):
+            section["archive"] = archive_records(config, spec, records, debug=debug)
+
+    # Sources revise earlier days without always adding a new one, a revised series is published too
+    updated, digest = False, None
+    if records is not None and spec.get("incremental"):
+        digest = incremental.digest(records, spec["splice_fields"])
+    revised = digest is not None and digest != (section.get("checkpoint") or {}).get("digest")
+    if records is not None and (update_time > section["update_time"] or revised or (force_refresh and not debug)):
+        with metrics.timer("derive"):
+            section.update(publish(state, spec, records, debug=debug))
+        section["update_time"] = update_time
+        if spec.get("incremental"):
+            section["checkpoint"] = incremental.checkpoint(records, digest=digest)
+        updated = True
+
+    # Every area read is published, even without a new day for the state's own series
+    if area_series is not None and records is not None:
+        statewide = spec["filters"][spec["group_by"]]
+        area_series[statewide] = records
+        with metrics.timer("derive"):
+            for area_records in area_series.values():
+                spec["derive"](area_records)
+        section["areas"] = areas.publish_areas(area_series, spec["name"], config, statewide=statewide, debug=debug)
+        section["areas"]["update_time"] = update_time
+        updated = True
+
+    section["source"] = fetch.validators
+    # Left behind by earlier versions, which read the pages fields were last found on first
+    section.pop("page_hints", None)
+    return records, updated, fetch
+
+
+def run_state(state, debug=False, force_refresh=False, incremental_epi=True, invalidations=None):
+    # With an InvalidationCollector the changed paths are left to the caller to invalidate in one
+    # batch with every other state, otherwise they are invalidated right away.
+    config = state["config"]
+    metadata, updated, sources_changed, results = get_metadata(state), False, False, {}
+    for spec in state["sources"]:
+        with metrics.scope(config.state, spec["name"]):
+            records, source_updated, fetch = _run_source(
+                state, spec, metadata, debug=debug, force_refresh=force_refresh, incremental_series=incremental_epi
+            )
+        results[spec["name"]] = records
+        updated = updated or source_updated
+        sources_changed = sources_changed or fetch.changed
+
+    bundle_changed = False
+    if not debug and (updated or "bundle" not in metadata):
+        # The bundle holds the series themselves so it changes whenever they do
+        with metrics.scope(config.state, "bundle"), metrics.timer("derive"):
+            bundle_changed = bundle.publish_state_bundle(
+                metadata, config, sections=[spec["name"] for spec in state["sources"]]
+            )
+
+    if debug:
+        for name, records in results.items():
+            print(f"{config.state} {name}:")
+            pprint((records or [])[-25:])
+    elif updated or sources_changed or bundle_changed:
+        with metrics.scope(config.state, "metadata"):
+            upload_metadata(metadata, config)
+        # New validators alone don't change anything the site reads, so only invalidate for new data
+        if updated and invalidations is not None:
+            invalidations.add(["/" + config.get_processed_metadata_key()])
+        elif updated:
+            invalidate_cloudfront_paths(["/" + config.get_processed_metadata_key()])
+    return metadata
+
+
+def main(state, argv=None):
+    # Command line of a state module, e.g. `python wa.py rebuild-manifest --debug`
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "rebuild-manifest"])
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--force-refresh", action="store_true")
+    args = parser.parse_args(argv)
+    if args.command == "rebuild-manifest":
+        for spec in state["sources"]:
+            if spec.get("reports"):
+                pprint(spec["reports"].rebuild_manifest(debug=args.debug, force_refresh=args.force_refresh))
+    else:
+        run_state(state, debug=args.debug, force_refresh=args.force_refresh)
@@ -3,3 +3,14 @@
 
 class DependencyError(Exception):
     pass
+
+
+class ParseError(Exception):
+    pass
+
+
+class StateRunError(Exception):
+    def __init__(self, failures):
+        self.failures = failures
+        summary = ", ".join(f"{state}: {ex!r}" for state, ex in failures.items())
+        super().__init__(f"{len(failures)} state(s) failed to run: {summary}")
@@ -0,0 +1,256 @@
+import codecs
+import csv
+import hashlib
+import itertools
+import re
+import threading
+import time
+
+try:
+    from beyblade_lambda import metrics
+    from beyblade_lambda.cache import get_cache
+    from beyblade_lambda.exceptions import DependencyError
+except ModuleNotFoundError:
+    # To support running for local testing
+    import metrics
+    from cache import get_cache
+    from exceptions import DependencyError
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Line breaks for str.splitlines but not for csv
+_OTHER_LINE_BREAKS = "\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_LINE_PATTERN = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)")
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    # One requests session for every fetch, so connections to the same host are reused. Other
+    # transports (e.g. the benchmark's fixture replay) can be mounted on it.
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                # requests (and urllib3) take a while to import and aren't needed until the first fetch
+                import requests
+
+                _SESSION = requests.Session()
+    return _SESSION
+
+
+class ConditionalFetch:
+    # Fetches a source with the validators stored from the previous run (see metadata[...]["source"])
+    # and records the new ones. A source is unchanged when the server answers 304, or when it
+    # ignores the validators but the raw bytes hash to the same md5 as last time.
+    #
+    # Every body read in full is kept in the tiered cache (see cache.py) with its validators. When
+    # there is a cached copy the request is made with its validators instead, and a 304 is
+    # answered from the cache: a forced refresh, or a run after one that failed before saving
+    # metadata, parses the cached copy instead of downloading it again. If the copy has been
+    # evicted by the time it is read, the body is requested again without validators.
+    def __init__(self, url, previous=None, force=False, cache=None):
+        self._url = url
+        self._previous = previous or {}
+        self._force = force
+        self._cache = cache or get_cache()
+        self._cache_key = f"url:{url}"
+        self._cached = None
+        self.from_cache = False
+        self._md5 = hashlib.md5()
+        self.validators = dict(self._previous)
+        self.status_code = None
+        self.bytes_read = 0
+        # Seconds spent waiting on the server, even when the content is streamed into a parser
+        self.elapsed = 0.0
+        self.not_modified = False
+        self.finished = False
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def unchanged(self):
+        if self._force:
+            return False
+        if self.not_modified:
+            return True
+        return self.finished and self.validators.get("md5") == self._previous.get("md5")
+
+    @property
+    def changed(self):
+        return self.validators != self._previous
+
+    def _request_headers(self, conditional=True):
+        headers = {}
+        self._cached = self._cache.version(self._cache_key) if self._cache and conditional else None
+        validators = self._cached or ({} if self._force or not conditional else self._previous)
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def _open(self, stream, conditional=True):
+        start = time.perf_counter()
+        resp = get_session().get(self.url, headers=self._request_headers(conditional), stream=stream)
+        self.elapsed += time.perf_counter() - start
+        self.status_code = resp.status_code
+        if resp.status_code == 304 and self._cached and (
+            self._force or self._cached.get("md5") != self._previous.get("md5")
+        ):
+            # Our cached copy is current and hasn't been processed yet, it is read instead of the body
+            self.from_cache = True
+            self.validators = dict(self._cached)
+        elif resp.status_code == 304:
+            self.not_modified = True
+            self.finished = True
+            self._record()
+        elif resp.status_code != 200:
+            resp.close()
+            raise DependencyError(f"Attempt to retrieve {self.url} returned status code: {resp.status_code}")
+        else:
+            self.validators["etag"] = resp.headers.get("ETag")
+            self.validators["last_modified"] = resp.headers.get("Last-Modified")
+        return resp
+
+    def _refetch(self, stream):
+        # The cached copy the 304 was answered for has been evicted since, so the body is downloaded
+        # after all. Without validators, or the server would answer 304 again.
+        self.from_cache = False
+        return self._open(stream, conditional=False)
+
+    def _record(self):
+        metrics.add_time(
+            "fetch", self.elapsed, BytesIn=self.bytes_read, CacheHits=int(self.unchanged), LocalHits=int(self.from_cache)
+        )
+
+    def _finish(self):
+        if self.from_cache and self._md5.hexdigest() != self._cached.get("md5"):
+            # Evicted (or removed) while it was being read
+            raise DependencyError(f"The cached copy of {self.url} is incomplete")
+        self.validators["md5"] = self._md5.hexdigest()
+        self.finished = True
+        self._record()
+
+    def iter_content(self, chunk_size=STREAM_CHUNK_SIZE):
+        resp = self._open(stream=True)
+        try:
+            if self.not_modified:
+                return
+            chunks, writer = None, None
+            if self.from_cache:
+                chunks = self._cache.iter_chunks(self._cache_key, chunk_size)
+                first = next(chunks, None)
+                if first is None:
+                    resp.close()
+                    resp, chunks = self._refetch(stream=True), None
+                else:
+                    chunks = itertools.chain([first], chunks)
+            if chunks is None:
+                chunks = resp.iter_content(chunk_size=chunk_size)
+                writer = self._cache.writer(self._cache_key, None) if self._cache else None
+            try:
+                while True:
+                    start = time.perf_counter()
+                    chunk = next(chunks, None)
+                    self.elapsed += time.perf_counter() - start
+                    if chunk is None:
+                        break
+                    self._md5.update(chunk)
+                    if not self.from_cache:
+                        self.bytes_read += len(chunk)
+                    if writer:
+                        writer.write(chunk)
+                    yield chunk
+            except BaseException:
+                # Including the consumer stopping early, the body isn't complete
+                if writer:
+                    writer.abort()
+                raise
+        finally:
+            resp.close()
+        self._finish()
+        if writer:
+            writer.commit(dict(self.validators))
+
+    def content(self):
+        # Returns None when the source has not changed since the validators were recorded
+        resp = self._open(stream=False)
+        if self.not_modified:
+            return None
+        cached = self._cache.get(self._cache_key) if self.from_cache else None
+        if self.from_cache and cached is None:
+            resp = self._refetch(stream=False)
+        start = time.perf_counter()
+        if self.from_cache:
+            content = cached[0]
+        else:
+            content = resp.content
+            self.bytes_read += len(content)
+        self.elapsed += time.perf_counter() - start
+        self._md5.update(content)
+        self._finish()
+        if self._cache and not self.from_cache:
+            self._cache.put(self._cache_key, content, dict(self.validators))
+        return None if self.unchanged else content
+
+
+def _split_lines(text):
+    # Lines ending at \r, \n or \r\n as in csv, the last one possibly incomplete. str.splitlines
+    # also splits at other characters (e.g. \x1e or \u2028), which are part of a field in csv, so
+    # it is only used when the text has none of them.
+    if not any(c in text for c in _OTHER_LINE_BREAKS):
+        return text.splitlines(keepends=True)
+    lines = _LINE_PATTERN.findall(text)
+    rest = text[sum(len(line) for line in lines):]
+    return lines + [rest] if rest else lines
+
+
+def _iter_decoded_lines(chunks, encoding="utf-8"):
+    # Decode incrementally so multi-byte characters split across chunks survive, and only
+    # ever hold one chunk plus the trailing partial line in memory.
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = _split_lines(pending)
+        # A trailing \r may be the first half of a \r\n split across chunks
+        if lines and not lines[-1].endswith("\n"):
+            pending = lines.pop()
+        else:
+            pending = ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    yield from _split_lines(pending)
+
+
+def stream_csv_rows(url, fetch=None, encoding="utf-8", chunk_size=STREAM_CHUNK_SIZE):
+    # Pass a ConditionalFetch to make the request conditional; nothing is yielded on a 304.
+    fetch = fetch or ConditionalFetch(url)
+    yield from csv.reader(_iter_decoded_lines(fetch.iter_content(chunk_size=chunk_size), encoding=encoding))
+
+
+def stream_csv_records(url, columns, filters=None, fetch=None, encoding="utf-8", chunk_size=STREAM_CHUNK_SIZE):
+    # Yields dicts of only the requested columns for rows that match every filter. Filters are
+    # checked against the raw row before anything is built so dropped rows cost almost nothing.
+    column_map, filter_idx, scanned, kept = {}, [], 0, 0
+    try:
+        for row in stream_csv_rows(url, fetch=fetch, encoding=encoding, chunk_size=chunk_size):
+            if not row:
+                continue
+            if not column_map:
+                for i, item in enumerate(row):
+                    if item in columns:
+                        column_map[item] = i
+                filter_idx = [(column_map[k], v) for k, v in (filters or {}).items()]
+                continue
+            scanned += 1
+            if any(row[i] != v for i, v in filter_idx):
+                continue
+            kept += 1
+            yield {k: row[i] for k, i in column_map.items()}
+    finally:
+        metrics.add("parse", RowsScanned=scanned, RowsKept=kept)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+from bisect import bisect_left
+
+try:
+    from beyblade_lambda import dates, metrics
+    from beyblade_lambda.artifacts import url_to_key
+    from beyblade_lambda.lib import get_processed_data
+except ModuleNotFoundError:
+    # To support running for local testing
+    import dates
+    import metrics
+    from artifacts import url_to_key
+    from lib import get_processed_data
+
+
+# Bump whenever the shape or meaning of a published series changes so that old series are
+# rebuilt from scratch rather than spliced into.
+# 2: dates are Pacific midnight whatever the host's timezone (see dates.py)
+CHECKPOINT_VERSION = 2
+
+
+def load_previous_series(section):
+    # `section` is metadata["epi"] (or similar). Returns the published records when they can be
+    # spliced into, otherwise None and the caller does a full rebuild.
+    checkpoint = section.get("checkpoint") or {}
+    if checkpoint.get("version") != CHECKPOINT_VERSION or not section.get("url"):
+        return None
+    records = get_processed_data(url_to_key(section["url"]))
+    if not records or len(records) != checkpoint.get("rows") or records[-1]["date"] != checkpoint.get("last_date"):
+        return None
+    return records
+
+
+def previous_loader(section):
+    # Returns a function loading the published series (see load_previous_series) on its first call
+    # only. Refresh hooks call it once the source has turned out to have changed, so a run where
+    # every source answers 304 never downloads the series.
+    loaded = []
+
+    def load():
+        if not loaded:
+            with metrics.timer("load_previous"):
+                loaded.append(load_previous_series(section))
+        return loaded[0]
+    return load
+
+
+def revision_cutoff(previous, lookback_days):
+    # Sources revise recent days, so everything within the look-back window is re-parsed
+    return dates.add_days(previous[-1]["date"], -lookback_days)
+
+
+def lazy_cutoff(load_previous, lookback_days):
+    # revision_cutoff as a function for engine.read_records' `since`, so the previous series is
+    # only loaded once there are rows to cut. None without a loader.
+    if load_previous is None:
+        return None
+
+    def since():
+        previous = load_previous()
+        return revision_cutoff(previous, lookback_days) if previous else None
+    return since
+
+
+def splice(previous, tail, fields=("date", "deaths")):
+    # Replaces every previous record dated on/after the first record of the freshly parsed (and
+    # sorted) tail with the tail. Returns the merged records and the index of the first record that
+    # actually differs, which is where derived columns need to be recomputed from.
+    if not tail:
+        return previous, len(previous)
+    keep = bisect_left([r["date"] for r in previous], tail[0]["date"])
+    merged = previous[:keep] + tail
+    changed, limit = keep, min(len(previous), len(merged))
+    while changed < limit and all(previous[changed][f] == merged[changed][f] for f in fields):
+        merged[changed] = previous[changed]
+        changed += 1
+    return merged, changed
+
+
+def digest(records, fields):
+    # md5 of the fields read from the source, kept in the checkpoint so that a run can tell a
+    # revised series from the published one even when it has no new day
+    values = [[r[f] for f in fields] for r in records]
+    return hashlib.md5(json.dumps(values, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def checkpoint(records, **extra):
+    return dict(version=CHECKPOINT_VERSION, last_date=records[-1]["date"], rows=len(records), **extra)
@@ -0,0 +1,95 @@
+import posixpath
+import threading
+import time
+
+try:
+    from beyblade_lambda.storage import get_storage
+except ModuleNotFoundError:
+    # To support running for local testing
+    from storage import get_storage
+
+
+# A directory with at least this many invalidated paths is invalidated as "<dir>/*" instead.
+# CloudFront bills a wildcard like a single path.
+WILDCARD_MIN_PATHS = 3
+# Keep each batch well under CloudFront's limit of 15 in-flight wildcard / 3000 in-flight paths
+MAX_INVALIDATION_PATHS = 15
+
+
+def _parent(path):
+    if path.endswith("/*"):
+        path = path[:-2]
+    parent = posixpath.dirname(path)
+    return "/*" if parent in ("", "/") else f"{parent}/*"
+
+
+def _covers(wildcard, path):
+    return path != wildcard and path.startswith(wildcard[:-1])
+
+
+def coalesce_paths(paths, min_paths=WILDCARD_MIN_PATHS, max_paths=MAX_INVALIDATION_PATHS):
+    # Collapses paths into wildcards where that means fewer paths: every directory holding at
+    # least `min_paths` paths becomes "<dir>/*", then the most crowded directories are collapsed
+    # until there are at most `max_paths` left.
+    result = set(paths)
+
+    def collapse(wildcard):
+        nonlocal result
+        result = {p for p in result if not _covers(wildcard, p)} | {wildcard}
+
+    groups = {}
+    for path in result:
+        groups.setdefault(_parent(path), set()).add(path)
+    for wildcard, members in groups.items():
+        if len(members) >= min_paths:
+            collapse(wildcard)
+
+    while len(result) > max_paths:
+        groups = {}
+        for path in result:
+            groups.setdefault(_parent(path), set()).add(path)
+        wildcard = max(groups, key=lambda w: (len(groups[w]), w.count("/")))
+        if len(groups[wildcard]) == 1 and wildcard == "/*":
+            break
+        collapse(wildcard)
+    return sorted(result)
+
+
+class InvalidationCollector:
+    # Collects the CloudFront paths every state changed during a run so they can be sent as one
+    # batched invalidation at the end (see runner.main). Safe to share between state threads.
+    def __init__(self, min_paths=WILDCARD_MIN_PATHS, max_paths=MAX_INVALIDATION_PATHS):
+        self._paths = set()
+        self._lock = threading.Lock()
+        self._min_paths = min_paths
+        self._max_paths = max_paths
+
+    def add(self, paths):
+        with self._lock:
+            self._paths.update(paths)
+
+    @property
+    def paths(self):
+        with self._lock:
+            return sorted(self._paths)
+
+    def flush(self, wait=False, storage=None):
+        # Sends a single invalidation for everything collected and returns a timing report
+        paths = self.paths
+        report = {"requested_paths": len(paths), "paths": [], "invalidation_id": None}
+        if not paths:
+            return report
+        storage = storage or get_storage()
+        report["paths"] = coalesce_paths(paths, min_paths=self._min_paths, max_paths=self._max_paths)
+
+        start = time.monotonic()
+        resp = storage.invalidate(report["paths"])
+        report["submit_seconds"] = round(time.monotonic() - start, 3)
+        report["invalidation_id"] = ((resp or {}).get("Invalidation") or {}).get("Id")
+        if wait:
+            storage.wait_for_invalidation(report["invalidation_id"])
+            report["complete_seconds"] = round(time.monotonic() - start, 3)
+
+        with self._lock:
+            self._paths.difference_update(paths)
+        return report
@@ -1,54 +1,94 @@
-import base64
-import boto3 as boto
 import hashlib
 import json
-import time
-
-from io import BytesIO
-
 
 try:
-    from beyblade_lambda.constants import BEYBLADE_S3_BUCKET, CLOUDFRONT_DISTRIBUTION
+    from beyblade_lambda import metrics, uploads
+    from beyblade_lambda.artifacts import exists, put_artifact
+    from beyblade_lambda.constants import BEYBLADE_URL, IMMUTABLE_CACHE_CONTROL, METADATA_CACHE_CONTROL
+    from beyblade_lambda.encoding import available_encodings, encode, encoded_key
+    from beyblade_lambda.storage import get_storage
+    from beyblade_lambda.wire import FLOAT_PRECISION, WIRE_VERSION, to_columnar
 except ModuleNotFoundError:
     # To support running for local testing
-    from constants import BEYBLADE_S3_BUCKET, CLOUDFRONT_DISTRIBUTION
+    import metrics
+    import uploads
+    from artifacts import exists, put_artifact
+    from constants import BEYBLADE_URL, IMMUTABLE_CACHE_CONTROL, METADATA_CACHE_CONTROL
+    from encoding import available_encodings, encode, encoded_key
+    from storage import get_storage
+    from wire import FLOAT_PRECISION, WIRE_VERSION, to_columnar
+
 
 def upload_processed_data(data_str, data_key):
-    client = boto.client("s3")
-    data_upload_md5 = base64.b64encode(hashlib.md5(data_str).digest()).decode("utf-8")
-    client.put_object(
-        ACL="private",
-        Bucket=BEYBLADE_S3_BUCKET,
-        Key=data_key,
-        Body=BytesIO(data_str),
-        ContentMD5=data_upload_md5,
-        ContentType="application/json"
-    )
+    get_storage().put(data_key, data_str, "application/json")
+
+
+def publish_artifact(data_str, data_key, content_type="application/json", encodings=None):
+    # For content addressed artifacts the site reads: stores the data plus a pre-compressed copy
+    # per encoding, all cacheable forever. Keys that already exist are left alone. Returns the
+    # size of each variant written.
+    storage, sizes = get_storage(), {}
+    encodings = encodings or available_encodings()
+    with metrics.timer("upload"):
+        if put_artifact(data_key, data_str, content_type, storage=storage, CacheControl=IMMUTABLE_CACHE_CONTROL):
+            sizes["identity"] = len(data_str)
+        for encoding in encodings:
+            key = encoded_key(data_key, encoding)
+            # Checked separately as variants were added after the first artifacts were published
+            if exists(key, storage):
+                continue
+            with metrics.timer("serialize"):
+                encoded = encode(data_str, encoding)
+            storage.put(
+                key, encoded, content_type, ContentEncoding=encoding, CacheControl=IMMUTABLE_CACHE_CONTROL
+            )
+            sizes[encoding] = len(encoded)
+    metrics.add("upload", BytesOut=sum(sizes.values()), Uploads=len(sizes), Skips=len(encodings) + 1 - len(sizes))
+    return sizes
+
+
+def publish_series(records, name, data_key, config, date_fields=("date",), precision=FLOAT_PRECISION, debug=False):
+    # Publishes records both as a list of rows (data_key maps the md5 to its key) and in the
+    # columnar wire format. Returns the metadata section fields pointing at both.
+    with metrics.timer("serialize"):
+        records_str = json.dumps(records).encode("utf-8")
+        columnar = to_columnar(records, date_fields=date_fields, precision=precision)
+        columnar_str = json.dumps(columnar, separators=(",", ":")).encode("utf-8")
+    records_key = data_key(hashlib.md5(records_str).hexdigest())
+    columnar_key = config.get_processed_columnar_key(name, WIRE_VERSION, hashlib.md5(columnar_str).hexdigest())
+    if not debug:
+        publish_artifact(records_str, records_key)
+        publish_artifact(columnar_str, columnar_key)
+
+    encodings = available_encodings()
+    return {
+        "url": f"{BEYBLADE_URL.rstrip('/')}/{records_key}",
+        "encodings": encodings,
+        "columnar": {
+            "url": f"{BEYBLADE_URL.rstrip('/')}/{columnar_key}",
+            "version": WIRE_VERSION,
+            "encodings": encodings,
+        },
+    }
+
+
+def get_processed_data(data_key):
+    data = get_storage().get(data_key)
+    if data is None:
+        return None
+    return json.loads(data)
 
 
 def upload_metadata(metadata, config):
-        client = boto.client("s3")
+    # Never visible before the artifacts it points at
+    uploads.barrier()
+    with metrics.timer("metadata"):
         metadata_str = json.dumps(metadata).encode("utf-8")
-        metadata_upload_md5 = base64.b64encode(hashlib.md5(metadata_str).digest()).decode("utf-8")
-        client.put_object(
-            ACL="private",
-            Bucket=BEYBLADE_S3_BUCKET,
-            Key=config.get_processed_metadata_key(),
-            Body=BytesIO(metadata_str),
-            ContentMD5=metadata_upload_md5,
-            ContentType="application/json"
+        get_storage().put(
+            config.get_processed_metadata_key(), metadata_str, "application/json", CacheControl=METADATA_CACHE_CONTROL
         )
+    metrics.add("metadata", BytesOut=len(metadata_str))
 
 
 def invalidate_cloudfront_paths(paths):
-    client = boto.client('cloudfront')
-    client.create_invalidation(
-        DistributionId=CLOUDFRONT_DISTRIBUTION,
-        InvalidationBatch={
-            "Paths": {
-                "Quantity": len(paths),
-                "Items": paths
-            },
-            "CallerReference": str(time.time()),
-        }
-    )
+    get_storage().invalidate(paths)
@@ -0,0 +1,150 @@
+import contextlib
+import contextvars
+import json
+import sys
+import threading
+import time
+
+
+# Per state/source/stage metrics for a run, written out as CloudWatch Embedded Metric Format
+# log lines (one per state, source and stage) that CloudWatch turns into metrics.
+#
+#   with metrics.scope("ca", "epi"):
+#       with metrics.timer("parse"):
+#           ...
+#       metrics.add("parse", RowsScanned=n)
+#
+# Timers are exclusive: time recorded by a nested timer (or by add_time, e.g. a fetch streamed
+# while parsing) is taken out of the enclosing one, so stage durations add up to the total.
+# Outside of a scope every call is a no-op, so library code can record unconditionally.
+NAMESPACE = "beyblade"
+DIMENSIONS = ["State", "Source", "Stage"]
+UNITS = {
+    "Duration": "Milliseconds",
+    "BytesIn": "Bytes",
+    "BytesOut": "Bytes",
+}
+DEFAULT_UNIT = "Count"
+
+_SCOPE = contextvars.ContextVar("metrics_scope", default=None)
+_TIMERS = contextvars.ContextVar("metrics_timers", default=())
+
+
+class StdoutSink:
+    # Lambda forwards stdout to CloudWatch Logs, which extracts the metrics
+    def write(self, document):
+        sys.stdout.write(json.dumps(document) + "\n")
+        sys.stdout.flush()
+
+
+class MemorySink:
+    def __init__(self):
+        self.documents = []
+
+    def write(self, document):
+        self.documents.append(document)
+
+
+class Recorder:
+    def __init__(self, sink=None, namespace=NAMESPACE):
+        self.sink = sink or StdoutSink()
+        self.namespace = namespace
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, state, source, stage, **values):
+        with self._lock:
+            stage_values = self._values.setdefault((state, source, stage), {})
+            for name, value in values.items():
+                stage_values[name] = stage_values.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(values) for key, values in self._values.items()}
+
+    def flush(self, timestamp=None):
+        # Writes one EMF document per state/source/stage and starts over. Returns the documents.
+        with self._lock:
+            values, self._values = self._values, {}
+        timestamp = int((timestamp or time.time()) * 1000)
+        documents = []
+        for (state, source, stage), stage_values in sorted(values.items()):
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [DIMENSIONS],
+                        "Metrics": [
+                            {"Name": name, "Unit": UNITS.get(name, DEFAULT_UNIT)} for name in sorted(stage_values)
+                        ],
+                    }],
+                },
+                "State": state,
+                "Source": source,
+                "Stage": stage,
+            }
+            document.update({name: round(value, 3) for name, value in stage_values.items()})
+            self.sink.write(document)
+            documents.append(document)
+        return documents
+
+
+_RECORDER = Recorder()
+
+
+def get_recorder():
+    return _RECORDER
+
+
+def set_recorder(recorder):
+    global _RECORDER
+    _RECORDER = recorder
+    return recorder
+
+
+@contextlib.contextmanager
+def scope(state, source):
+    token = _SCOPE.set((state, source))
+    timers = _TIMERS.set(())
+    try:
+        yield
+    finally:
+        _TIMERS.reset(timers)
+        _SCOPE.reset(token)
+
+
+def add(stage, **values):
+    current = _SCOPE.get()
+    if current is not None:
+        _RECORDER.add(current[0], current[1], stage, **values)
+
+
+def add_time(stage, seconds, **values):
+    # Records time spent in `stage` from inside another stage's timer
+    if _SCOPE.get() is None:
+        return
+    timers = _TIMERS.get()
+    if timers:
+        timers[-1][0] += seconds
+    add(stage, Duration=seconds * 1000, **values)
+
+
+@contextlib.contextmanager
+def timer(stage, exclusive=True):
+    # With exclusive=False nested timings are not taken out (for a stage that is a total)
+    if _SCOPE.get() is None:
+        yield
+        return
+    excluded = [0.0]
+    enclosing = _TIMERS.get()
+    token = _TIMERS.set(enclosing + ((excluded,) if exclusive else ()))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _TIMERS.reset(token)
+        elapsed = time.perf_counter() - start
+        if enclosing:
+            enclosing[-1][0] += elapsed
+        add(stage, Duration=(elapsed - excluded[0]) * 1000)
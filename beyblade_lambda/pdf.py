@@ -0,0 +1,76 @@
+from io import BytesIO
+
+try:
+    from beyblade_lambda import metrics
+    from beyblade_lambda.exceptions import ParseError
+except ModuleNotFoundError:
+    # To support running for local testing
+    import metrics
+    from exceptions import ParseError
+
+
+# Characters of the next page kept after each one, so a field split across a page break is still
+# found.
+PAGE_OVERLAP = 1000
+
+
+def _last_match(pattern, text, end):
+    # The match starting last before `end`, like re.match(".*" + pattern + ".*") over the whole text
+    last, pos = None, 0
+    while pos < end:
+        match = pattern.search(text, pos)
+        if match is None or match.start() >= end:
+            break
+        last, pos = match, match.start() + 1
+    return last
+
+
+class FieldExtractor:
+    # Finds a set of regex fields in a PDF in a single pass over its pages. Every field is the last
+    # occurrence of its pattern in the document, as with the greedy ".*field.*" patterns the report
+    # parsers used to match against the whole text. Pages are extracted lazily from the last one
+    # back, so reading stops as soon as every required group has a match: the pages before it can
+    # only hold earlier occurrences. `fields` maps a field name to a compiled pattern (searched, so
+    # no leading ".*" is needed); `required` is a list of groups of field names where any one match
+    # satisfies the group, listed in order of preference.
+    def __init__(self, fields, required=None, overlap=PAGE_OVERLAP):
+        self.fields = fields
+        self.required = required or [(name,) for name in fields]
+        self.overlap = overlap
+
+    def _complete(self, found):
+        # A group is done once its most preferred field is found, or any field once every page is read
+        return all(group[0] in found for group in self.required)
+
+    def _missing(self, found):
+        return [group for group in self.required if not any(name in found for name in group)]
+
+    def extract(self, pdf_bytes):
+        # Returns ({field: match groups}, {field: page index}, number of pages read)
+        # Imported here so that states without new reports never pay for importing PyPDF2
+        import PyPDF2 as pypdf
+
+        reader = pypdf.PdfFileReader(BytesIO(pdf_bytes))
+        found, pages, pages_read = {}, {}, 0
+        next_head = ""
+        for p in reversed(range(reader.numPages)):
+            text = reader.getPage(p).extractText().replace("\n", "")
+            pages_read += 1
+            # A match is on the page it starts on, so one running into the next page is this page's.
+            # Matches starting on the next page were looked for when it was read.
+            window = text + next_head
+            for name, pattern in self.fields.items():
+                if name in found:
+                    continue
+                match = _last_match(pattern, window, len(text))
+                if match:
+                    found[name], pages[name] = match.groups(), p
+            if self._complete(found):
+                break
+            next_head = text[:self.overlap]
+
+        metrics.add("parse", PagesRead=pages_read, PagesTotal=reader.numPages)
+        missing = self._missing(found)
+        if missing:
+            raise ParseError(f"Could not find fields {missing} in {pages_read} page(s)")
+        return found, pages, pages_read
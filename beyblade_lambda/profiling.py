@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+
+# `python -X importtime` writes one line per imported module to stderr:
+#   import time: self [us] | cumulative | imported package
+# The indentation of the module name gives its depth in the import tree.
+
+def _parse_importtime(stderr):
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return records
+
+
+def import_time_report(module, python=sys.executable, cwd=None):
+    # Imports `module` in a fresh interpreter (so nothing is cached, like a lambda cold start) and
+    # returns {"module", "total_us", "imports": [{"module", "depth", "self_us", "cumulative_us"}]}
+    # with imports in the order they completed.
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=cwd, env=env
+    )
+    if proc.returncode != 0:
+        raise ImportError(f"Importing {module} failed:\n{proc.stderr}")
+    imports = _parse_importtime(proc.stderr)
+    top = [r for r in imports if r["module"] == module]
+    return {
+        "module": module,
+        "total_us": top[-1]["cumulative_us"] if top else sum(r["self_us"] for r in imports),
+        "imports": imports,
+    }
+
+
+def imported_modules(report):
+    return {r["module"] for r in report["imports"]}
+
+
+def slowest_imports(report, limit=15):
+    return sorted(report["imports"], key=lambda r: r["self_us"], reverse=True)[:limit]
+
+
+if __name__ == "__main__":
+    import json
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for target in sys.argv[1:] or ["beyblade_lambda.runner", "beyblade_lambda.ca", "beyblade_lambda.wa"]:
+        report = import_time_report(target, cwd=root)
+        print(json.dumps({
+            "module": target,
+            "total_ms": round(report["total_us"] / 1000, 1),
+            "slowest": [
+                {"module": r["module"], "self_ms": round(r["self_us"] / 1000, 1)}
+                for r in slowest_imports(report, limit=10)
+            ],
+        }, indent=2))
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pprint import pprint
+
+try:
+    from beyblade_lambda import dates, series, uploads
+    from beyblade_lambda.exceptions import DependencyError, ParseError
+    from beyblade_lambda.fetch import ConditionalFetch
+    from beyblade_lambda.lib import get_processed_data, upload_processed_data
+    from beyblade_lambda.storage import get_storage
+except ModuleNotFoundError:
+    # To support running for local testing
+    import dates
+    import series
+    import uploads
+    from exceptions import DependencyError, ParseError
+    from fetch import ConditionalFetch
+    from lib import get_processed_data, upload_processed_data
+    from storage import get_storage
+
+
+# Sources published as one PDF report at a time (the breakthrough reports), where every report is
+# archived as it comes out and the series is rebuilt from all of them. Each report is kept next to
+# its md5 and the record parsed from it, and a manifest lists every processed report so a normal
+# run reads one object instead of every report.
+
+# Concurrent S3 downloads when reprocessing every archived report (force_refresh)
+REPROCESS_DOWNLOAD_WORKERS = 8
+
+
+def parse_report(parse, content):
+    # `parse` turns the report into {report_date, start_date, end_date, case_count, death_count}
+    record = parse(content)
+    record["report_md5"] = hashlib.md5(content).hexdigest()
+    return record
+
+
+def report_record(spec, fields):
+    # The record of a report from the fields extracted from it (see engine.extract_fields), for
+    # reports with report_date, dates (start and end), case_count and death_count fields
+    to_timestamp = dates.converter(spec["date_format"])
+    start_date_raw, end_date_raw = fields["dates"]
+    return {
+        "report_date": to_timestamp(fields["report_date"][0]),
+        "start_date": to_timestamp(start_date_raw),
+        "end_date": to_timestamp(end_date_raw),
+        "case_count": int(fields["case_count"][0].replace(",", "")),
+        "death_count": int(fields["death_count"][0].replace(",", "")) if "death_count" in fields else None,
+    }
+
+
+def _download_report(storage, report_key):
+    report = storage.get(report_key)
+    if report is None:
+        raise DependencyError(f"Report {report_key} no longer exists")
+    return report
+
+
+def _parse_executor(max_workers=None):
+    # PDF text extraction is CPU bound so it goes to a process pool. Lambda has no /dev/shm, which
+    # multiprocessing needs for its queues, so fall back to parsing in a single thread there.
+    # Workers are spawned rather than forked: the state and upload threads are running by now, and
+    # a forked child would inherit any lock one of them holds (metrics, dates) already taken.
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    except (NotImplementedError, OSError):
+        return ThreadPoolExecutor(max_workers=1)
+
+
+def derive_series(records):
+    # Reports are cumulative: drops reports that repeat the next one's end date, then turns the
+    # death counts into deaths per day between reports. Returns the records.
+    remove_indices = []
+    for i in range(len(records)):
+        if i == 0 or i == len(records) - 1:
+            continue
+        if records[i]["end_date"] == records[i+1]["end_date"]:
+            remove_indices.append(i)
+
+    for i in sorted(remove_indices, reverse=True):
+        del records[i]
+
+    if records:
+        # The first report covers everything since its start date, later reports only the days
+        # since the previous report's end date. Counted in calendar days, a span over a DST change
+        # isn't a whole number of 24 hours.
+        end_dates = [dates.to_day(r["end_date"]) for r in records]
+        first_weeks = (end_dates[0] - dates.to_day(records[0]["start_date"])).days / 7
+        num_days = [None] + [(end_dates[i] - end_dates[i-1]).days for i in range(1, len(records))]
+        death_counts = series.column(records, "death_count")
+        deaths_delta = series.delta(death_counts, minimum=0)
+
+        for i in range(len(records)):
+            if i == 0:
+                records[i]["rolling_average"] = records[i]["death_count"] / first_weeks
+            else:
+                records[i]["rolling_average"] = deaths_delta[i] / num_days[i]
+            records[i]["cumulative_deaths"] = records[i]["death_count"]
+
+            # Moving to consistent object model across states
+            records[i]["date"] = records[i]["end_date"]
+    return records
+
+
+class ReportArchive:
+    # `spec` is the state's pdf source spec (see engine.py) and `parse` a module level function
+    # (it is sent to worker processes) turning a report's bytes into its fields.
+    def __init__(self, config, spec, parse):
+        self.config = config
+        self.spec = spec
+        self.parse = parse
+
+    def refresh(self, debug=False, force_refresh=False, fetch=None, load_previous=None):
+        # The source's refresh hook (see engine.py), the series is always rebuilt from every report.
+        # Get latest data, there is nothing to do if the report hasn't changed since the last run
+        latest_report, latest_data = self.get_latest(fetch=fetch)
+        if latest_report is None:
+            return None, None
+        # Get existing data, normally with a single GET of the manifest
+        manifest = None if force_refresh else self.get_manifest()
+        if manifest is None:
+            manifest = self.rebuild_manifest(debug=debug, force_refresh=force_refresh)
+        processed_data = sorted(manifest["reports"].values(), key=lambda x: x["report_date"])
+        processed_md5s = [r["report_md5"] for r in processed_data]
+        # The same report published again (or under another URL) is only archived once
+        if latest_data["report_md5"] not in processed_md5s:
+            if not debug:
+                self.upload_latest(latest_report, latest_data, manifest)
+            processed_data.append(latest_data)
+            processed_md5s.append(latest_data["report_md5"])
+
+        return processed_data[-1]["report_date"], processed_data
+
+    def get_latest(self, fetch=None):
+        fetch = fetch or ConditionalFetch(self.spec["url"])
+        content = fetch.content()
+        if content is None:
+            return None, None
+        # Let errors associated with parsing bubble up
+        return content, parse_report(self.parse, content)
+
+    def report_key(self, report_date):
+        report_fname = self.spec["report_fname"].format(date=dates.to_day(report_date).isoformat())
+        return f"{self.config.get_breakthrough_data_prefix().rstrip('/')}/{report_fname}"
+
+    def record_key(self, report_key):
+        # The record parsed from a report is kept next to it, per manifest version: records parsed
+        # for an older version are left behind and the report is parsed again
+        return report_key.replace(".pdf", f".v{self.spec['manifest_version']}.json")
+
+    def _upload_processed_report(self, report_data, data_key):
+        report_json_str = json.dumps(report_data).encode("utf-8")
+        upload_processed_data(report_json_str, data_key)
+
+    def _get_processed_report(self, report_key, debug=False, force_refresh=False):
+        json_key = self.record_key(report_key)
+        if not force_refresh:
+            record = get_processed_data(json_key)
+            if record is not None:
+                return record
+
+        record = parse_report(self.parse, _download_report(get_storage(), report_key))
+
+        if not debug:
+            self._upload_processed_report(record, json_key)
+
+        return record
+
+    def _get_processed_reports(self, debug=False, force_refresh=False):
+        records = []
+        objs = get_storage().list(self.config.get_breakthrough_data_prefix())
+        report_keys = [obj["Key"] for obj in objs if obj["Key"].endswith("pdf")]
+        if force_refresh:
+            records, summary = self.reprocess(report_keys, debug=debug)
+            pprint(summary)
+            # A manifest without every archived report would drop them from the series
+            failed = {key: result for key, result in summary.items() if not result["ok"]}
+            if failed:
+                error = ParseError if any(r["stage"] == "parse" for r in failed.values()) else DependencyError
+                raise error(f"{len(failed)} of {len(report_keys)} report(s) could not be reprocessed: {sorted(failed)}")
+            return records
+
+        for report_key in report_keys:
+            records.append((report_key, self._get_processed_report(report_key, debug=debug, force_refresh=force_refresh)))
+        return records
+
+    def reprocess(self, report_keys, debug=False, max_workers=None):
+        # Downloads every report concurrently and parses each one as soon as it arrives. A report that
+        # fails to download or parse is left out of the results and reported in the summary instead of
+        # aborting the batch (callers publishing the results must check it). Results are returned as
+        # (report_key, record) in report_date order.
+        storage = get_storage()
+        records, summary = [], {}
+        with ThreadPoolExecutor(max_workers=REPROCESS_DOWNLOAD_WORKERS) as downloads, _parse_executor(max_workers) as parses:
+            download_futures = {downloads.submit(_download_report, storage, key): key for key in report_keys}
+            parse_futures = {}
+            for future in as_completed(download_futures):
+                report_key = download_futures[future]
+                try:
+                    parse_futures[parses.submit(parse_report, self.parse, future.result())] = report_key
+                except Exception as ex:
+                    summary[report_key] = {"ok": False, "stage": "download", "error": repr(ex)}
+
+            for future in as_completed(parse_futures):
+                report_key = parse_futures[future]
+                try:
+                    record = future.result()
+                except Exception as ex:
+                    summary[report_key] = {"ok": False, "stage": "parse", "error": repr(ex)}
+                    continue
+                summary[report_key] = {"ok": True, "report_date": record["report_date"]}
+                records.append((report_key, record))
+
+        records = sorted(records, key=lambda r: r[1]["report_date"])
+        if not debug:
+            for report_key, record in records:
+                self._upload_processed_report(record, self.record_key(report_key))
+        return records, summary
+
+    def get_manifest(self):
+        manifest = get_processed_data(self.config.get_breakthrough_manifest_key())
+        if manifest is None or manifest.get("version") != self.spec["manifest_version"]:
+            return None
+        return manifest
+
+    def _upload_manifest(self, manifest):
+        # The manifest is a single object, so readers always see either the old or the new version,
+        # and it is written once every report it lists has been
+        uploads.barrier()
+        manifest_str = json.dumps(manifest).encode("utf-8")
+        upload_processed_data(manifest_str, self.config.get_breakthrough_manifest_key())
+
+    def rebuild_manifest(self, debug=False, force_refresh=False):
+        # Recreates the manifest from the archived reports; used when it is missing or has drifted
+        manifest = {"version": self.spec["manifest_version"], "reports": {}}
+        for report_key, record in self._get_processed_reports(debug=debug, force_refresh=force_refresh):
+            manifest["reports"][report_key] = record
+        if not debug:
+            self._upload_manifest(manifest)
+        return manifest
+
+    def upload_latest(self, latest_report, latest_data, manifest=None):
+        storage = get_storage()
+        report_key = self.report_key(latest_data["report_date"])
+        storage.put(report_key, latest_report, "application/pdf")
+        storage.put(f"{report_key}.md5", latest_data["report_md5"].encode("utf-8"), "text/plain")
+
+        report_json_key = self.record_key(report_key)
+        report_json_str = json.dumps(latest_data).encode("utf-8")
+        upload_processed_data(report_json_str, report_json_key)
+
+        # Only add the report to the manifest once everything it points at has been written
+        if manifest is not None:
+            manifest["reports"][report_key] = dict(latest_data)
+            self._upload_manifest(manifest)
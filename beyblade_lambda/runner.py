@@ -1,32 +1,145 @@
 #!/usr/bin/env python3
-import base64
-import boto3 as boto
-import hashlib
-import json
-import math
-import openpyxl
-import PyPDF2 as pypdf
-import requests
+import importlib
 import time
+import traceback
 
-from botocore.exceptions import ClientError
-from datetime import datetime, tzinfo
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from io import BytesIO
 
 try:
-    import beyblade_lambda.ca as cali
-    import beyblade_lambda.wa as wash
+    from beyblade_lambda import metrics, uploads
+    from beyblade_lambda.bundle import publish_index
+    from beyblade_lambda.cache import get_cache
+    from beyblade_lambda.constants import PROCESSED_INDEX_KEY
+    from beyblade_lambda.engine import run_state
+    from beyblade_lambda.exceptions import StateRunError
+    from beyblade_lambda.invalidation import InvalidationCollector
 except ModuleNotFoundError:
     # To support running for local testing
-    import ca as cali
-    import wa as wash
+    import metrics
+    import uploads
+    from bundle import publish_index
+    from cache import get_cache
+    from constants import PROCESSED_INDEX_KEY
+    from engine import run_state
+    from exceptions import StateRunError
+    from invalidation import InvalidationCollector
 
 
-def main(debug=False, force_refresh=False):
-    # TODO: convert to asyncio
-    cali.run(debug=debug, force_refresh=force_refresh)
-    wash.run(debug=debug, force_refresh=force_refresh)
+# State name -> the module declaring the state's sources (STATE, see engine.py) and the cost of
+# a run, the sum of engine.source_cost over its sources. The cost is declared here so scheduling
+# never imports a state; a state's module (and its heavy parser dependencies, openpyxl and
+# PyPDF2, once it has new data to parse) is only imported when it runs.
+STATES = {
+    "ca": {"module": "ca", "cost": 2},
+    "wa": {"module": "wa", "cost": 6},
+}
+
+
+def load_state(state):
+    module = STATES[state]["module"]
+    if __package__:
+        return importlib.import_module(f"{__package__}.{module}")
+    return importlib.import_module(module)
+
+
+def schedule(states):
+    # Most expensive first (by their declared cost), so the longest state never starts last when
+    # there are fewer workers than states
+    return sorted(states, key=lambda state: STATES[state]["cost"], reverse=True)
+
+
+def _run_state(state, debug=False, force_refresh=False, invalidations=None):
+    start = time.monotonic()
+    try:
+        with metrics.scope(state, "all"), metrics.timer("total", exclusive=False), uploads.owner(state):
+            run_state(load_state(state).STATE, debug=debug, force_refresh=force_refresh, invalidations=invalidations)
+            # The state's own queued writes, so a failed one fails this state and no other
+            uploads.barrier()
+    except Exception as ex:
+        traceback.print_exc()
+        return {"state": state, "ok": False, "error": ex, "elapsed": time.monotonic() - start}
+    return {"state": state, "ok": True, "error": None, "elapsed": time.monotonic() - start}
+
+
+def run_states(states, debug=False, force_refresh=False, invalidations=None, max_workers=None):
+    # Each state is independent (separate sources, separate S3 prefixes) and the work is
+    # almost entirely network bound, so a thread pool is enough to overlap them. A failing
+    # state only marks its own result; it never cancels the others.
+    max_workers = max_workers or len(states) or 1
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="state") as executor:
+        futures = [
+            executor.submit(
+                _run_state, state, debug=debug, force_refresh=force_refresh, invalidations=invalidations
+            )
+            for state in schedule(states)
+        ]
+        return [f.result() for f in futures]
+
+
+def summarize(results):
+    return {
+        r["state"]: {
+            "ok": r["ok"],
+            "error": repr(r["error"]) if r["error"] else None,
+            "elapsed": round(r["elapsed"], 3),
+        }
+        for r in results
+    }
+
+
+def main(debug=False, force_refresh=False, concurrent=True, max_workers=None, wait_for_invalidation=False):
+    # Every state adds the paths it changed to one collector, which sends a single invalidation
+    # once all states are done (including for states that succeeded when another failed). Writes
+    # are queued and uploaded concurrently for the whole run (see uploads.py).
+    invalidations = InvalidationCollector()
+    with uploads.write_behind() as queue:
+        if concurrent:
+            results = run_states(
+                STATES, debug=debug, force_refresh=force_refresh, invalidations=invalidations, max_workers=max_workers
+            )
+        else:
+            results = [
+                _run_state(state, debug=debug, force_refresh=force_refresh, invalidations=invalidations)
+                for state in STATES
+            ]
+
+        summary = summarize(results)
+        pprint(summary)
+        failures = {r["state"]: r["error"] for r in results if not r["ok"]}
+        if not debug:
+            # The index lists every state's bundle, so it is rebuilt once all of them are done. A
+            # failure here is reported like a failed state, after the invalidation still goes out.
+            try:
+                with metrics.scope("all", "index"), metrics.timer("metadata"):
+                    if publish_index(STATES):
+                        invalidations.add(["/" + PROCESSED_INDEX_KEY])
+            except Exception as ex:
+                traceback.print_exc()
+                failures["index"] = ex
+            # Uploads outside of any state (the index); every state has waited for its own
+            try:
+                queue.flush()
+            except Exception as ex:
+                traceback.print_exc()
+                failures["uploads"] = ex
+            with metrics.scope("all", "cloudfront"):
+                with metrics.timer("invalidation"):
+                    report = invalidations.flush(wait=wait_for_invalidation)
+                metrics.add("invalidation", Paths=len(report["paths"]))
+            pprint(report)
+    pprint({"uploads": queue.report()})
+    # The cache outlives the invocation in a warm container, its stats are per invocation
+    cache = get_cache()
+    if cache is not None:
+        pprint({"cache": cache.stats(reset=True)})
+    # One EMF log line per state, source and stage
+    metrics.get_recorder().flush()
+
+    # Re-raise so that lambda still reports the invocation as failed (and sends the email)
+    if failures:
+        raise StateRunError(failures)
+    return summary
 
 
 def lambda_event(*args, **kwargs):
@@ -0,0 +1,139 @@
+import importlib
+import importlib.util
+import os
+
+from array import array
+
+
+# "numpy" is used whenever it is installed unless overridden; the pure python backend has no
+# dependencies so it is always available (and is what runs in the lambda today). numpy itself is
+# only imported the first time the numpy backend is used.
+BACKEND = os.environ.get("BEYBLADE_SERIES_BACKEND") or (
+    "numpy" if importlib.util.find_spec("numpy") is not None else "python"
+)
+numpy = None
+
+
+def _backend(backend=None):
+    global numpy
+    backend = backend or BACKEND
+    if backend == "numpy" and numpy is None:
+        numpy = importlib.import_module("numpy")
+    return backend
+
+
+def column(records, field, typecode=None):
+    # Compact, contiguous copy of a single field. Integer fields stay integers (so sums are exact
+    # and serialize the same way); anything else falls back to doubles.
+    if typecode is not None:
+        return array(typecode, (r[field] for r in records))
+    try:
+        return array("q", (r[field] for r in records))
+    except TypeError:
+        return array("d", (r[field] for r in records))
+
+
+def assign(records, field, values, start=0):
+    # `values` holds the new values for records[start:], as returned by the operators below
+    for record, value in zip(records[start:], values):
+        record[field] = value
+    return records
+
+
+def first_missing(records, field):
+    # Index of the first record of the trailing run of records that don't have `field` yet
+    i = len(records)
+    while i > 0 and field not in records[i - 1]:
+        i -= 1
+    return i
+
+
+def _as_list(values):
+    return values.tolist() if hasattr(values, "tolist") else list(values)
+
+
+def _prefix_sums(values):
+    typecode = getattr(values, "typecode", None)
+    prefix, total = array(typecode, [0]) if typecode else [0], 0
+    for value in values:
+        total += value
+        prefix.append(total)
+    return prefix
+
+
+def rolling_sum(values, window, include_current=True, fill=0, backend=None, start=0):
+    # Window sums in O(n) using prefix sums. With include_current=False the window for index i is
+    # values[i-window:i] (the days *before* i), otherwise values[i-window+1:i+1]. Indices without a
+    # full window are set to `fill`. Only indices >= start are computed (and returned), which
+    # only needs the `window` values before start.
+    if start:
+        lo = max(0, start - window)
+        return rolling_sum(values[lo:], window, include_current=include_current, fill=fill, backend=backend)[start - lo:]
+    n, offset = len(values), 0 if include_current else 1
+    first = window - 1 + offset
+    if _backend(backend) == "numpy":
+        arr = numpy.asarray(values)
+        prefix = numpy.concatenate(([0], numpy.cumsum(arr)))
+        out = numpy.full(n, fill, dtype=prefix.dtype if isinstance(fill, int) else "float64")
+        if n > first:
+            ends = numpy.arange(first + 1 - offset, n + 1 - offset)
+            out[first:] = prefix[ends] - prefix[ends - window]
+        return _as_list(out)
+
+    prefix = _prefix_sums(values)
+    out = [fill] * n
+    for i in range(first, n):
+        end = i + 1 - offset
+        out[i] = prefix[end] - prefix[end - window]
+    return out
+
+
+def rolling_mean(values, window, include_current=True, fill=0, backend=None, start=0):
+    if start:
+        lo = max(0, start - window)
+        return rolling_mean(values[lo:], window, include_current=include_current, fill=fill, backend=backend)[start - lo:]
+    n, first = len(values), window - (1 if include_current else 0)
+    if _backend(backend) == "numpy":
+        sums = numpy.asarray(rolling_sum(values, window, include_current=include_current, fill=0, backend=backend))
+        out = numpy.full(n, fill, dtype="float64")
+        out[first:] = sums[first:] / window
+        return _as_list(out)
+
+    sums = rolling_sum(values, window, include_current=include_current, fill=0, backend=backend)
+    return [fill if i < first else sums[i] / window for i in range(n)]
+
+
+def cumulative(values, initial=0, backend=None, start=0):
+    # With start, `initial` should be the cumulative value at start - 1
+    if start:
+        return cumulative(values[start:], initial=initial, backend=backend)
+    if _backend(backend) == "numpy":
+        if not len(values):
+            return []
+        return _as_list(numpy.cumsum(numpy.asarray(values)) + initial)
+
+    out, total = [], initial
+    for value in values:
+        total += value
+        out.append(total)
+    return out
+
+
+def delta(values, first=None, minimum=None, backend=None):
+    # Difference from the previous value. The first entry has no predecessor and is `first`
+    # (or the value itself when `first` is None). Deltas below `minimum` are clamped to it.
+    if not len(values):
+        return []
+    if _backend(backend) == "numpy":
+        out = numpy.diff(numpy.asarray(values), prepend=values[0] if first is None else 0)
+        if minimum is not None:
+            out = numpy.maximum(out, minimum)
+        out = _as_list(out)
+        out[0] = values[0] if first is None else first
+        return out
+
+    out = [values[0] if first is None else first]
+    for i in range(1, len(values)):
+        diff = values[i] - values[i - 1]
+        out.append(diff if minimum is None or diff >= minimum else minimum)
+    return out
@@ -0,0 +1,307 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from datetime import datetime, timezone
+
+try:
+    from beyblade_lambda.cache import get_cache
+    from beyblade_lambda.constants import BEYBLADE_S3_BUCKET, CLOUDFRONT_DISTRIBUTION, CONTENT_ADDRESSED_KEY_PATTERN
+except ModuleNotFoundError:
+    # To support running for local testing
+    from cache import get_cache
+    from constants import BEYBLADE_S3_BUCKET, CLOUDFRONT_DISTRIBUTION, CONTENT_ADDRESSED_KEY_PATTERN
+
+
+# Connections kept open per client; enough for the concurrent state runs and upload pools
+MAX_POOL_CONNECTIONS = 32
+# Set to a directory to run the whole pipeline against the local filesystem instead of S3
+LOCAL_STORAGE_ENV = "BEYBLADE_LOCAL_STORAGE"
+
+
+class S3Storage:
+    # Clients are created lazily, once per process, and shared between threads (boto3 clients are
+    # thread safe, sessions are not). Lambda keeps module state between warm invocations so the
+    # clients and their connection pools are reused across runs.
+    def __init__(self, bucket=BEYBLADE_S3_BUCKET, distribution=CLOUDFRONT_DISTRIBUTION):
+        self._bucket = bucket
+        self._distribution = distribution
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        return self._bucket
+
+    def client(self, service="s3"):
+        if service not in self._clients:
+            with self._lock:
+                if service not in self._clients:
+                    import boto3
+                    from botocore.config import Config
+                    session = boto3.session.Session()
+                    self._clients[service] = session.client(
+                        service, config=Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+                    )
+        return self._clients[service]
+
+    def get(self, key):
+        # Returns the object's bytes, or None when the key doesn't exist
+        from botocore.exceptions import ClientError
+        try:
+            return self.client().get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except ClientError as ex:
+            if not ex.response['Error']['Code'] == 'NoSuchKey':
+                raise
+        return None
+
+    def get_conditional(self, key, etag=None):
+        # Returns (status, body, etag): 304 with no body when the object still has `etag`, 404
+        # when it doesn't exist
+        from botocore.exceptions import ClientError
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            resp = self.client().get_object(Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as ex:
+            code = ex.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                return 304, None, etag
+            if not code == 'NoSuchKey':
+                raise
+            return 404, None, None
+        return 200, resp["Body"].read(), resp["ETag"]
+
+    def head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            resp = self.client().head_object(Bucket=self.bucket, Key=key)
+        except ClientError as ex:
+            if not ex.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            return None
+        return {
+            "Key": key,
+            "ETag": resp["ETag"],
+            "Size": resp["ContentLength"],
+            "LastModified": resp["LastModified"],
+            "ContentType": resp.get("ContentType"),
+        }
+
+    def put(self, key, body, content_type, **extra):
+        # `extra` is passed through to put_object (CacheControl, ContentEncoding, ...)
+        content_md5 = base64.b64encode(hashlib.md5(body).digest()).decode("utf-8")
+        self.client().put_object(
+            ACL="private",
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentMD5=content_md5,
+            ContentType=content_type,
+            **extra
+        )
+
+    def list(self, prefix):
+        # Yields {"Key", "ETag", "Size", "LastModified"} for every object under prefix
+        paginator = self.client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj
+
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            self.client().delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True}
+            )
+
+    def wait_for_invalidation(self, invalidation_id, delay=10, max_attempts=60):
+        waiter = self.client("cloudfront").get_waiter("invalidation_completed")
+        waiter.wait(
+            DistributionId=self._distribution,
+            Id=invalidation_id,
+            WaiterConfig={"Delay": delay, "MaxAttempts": max_attempts}
+        )
+
+    def invalidate(self, paths):
+        return self.client("cloudfront").create_invalidation(
+            DistributionId=self._distribution,
+            InvalidationBatch={
+                "Paths": {
+                    "Quantity": len(paths),
+                    "Items": paths
+                },
+                "CallerReference": str(time.time()),
+            }
+        )
+
+
+class LocalStorage:
+    # Same interface as S3Storage backed by a directory, so the pipeline can run (and be timed)
+    # offline. Object metadata is kept next to each object in a ".meta.json" sidecar and
+    # invalidations are appended to "_invalidations.jsonl" in the root.
+    META_SUFFIX = ".meta.json"
+
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        return self._root
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self._root, key))
+        if not path.startswith(self._root + os.sep):
+            raise ValueError(f"Key {key} is outside of {self._root}")
+        return path
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as fs:
+                return fs.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def get_conditional(self, key, etag=None):
+        meta = self.head(key)
+        if meta is None:
+            return 404, None, None
+        if etag and meta["ETag"] == etag:
+            return 304, None, etag
+        body = self.get(key)
+        return (200, body, meta["ETag"]) if body is not None else (404, None, None)
+
+    def head(self, key):
+        try:
+            with open(self._path(key) + self.META_SUFFIX) as fs:
+                meta = json.load(fs)
+        except FileNotFoundError:
+            return None
+        meta["LastModified"] = datetime.fromtimestamp(meta["LastModified"], timezone.utc)
+        return meta
+
+    def put(self, key, body, content_type, **extra):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {
+            "Key": key,
+            "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+            "Size": len(body),
+            "LastModified": time.time(),
+            "ContentType": content_type,
+            **extra
+        }
+        # Write to a temporary file and rename so readers never see a partial object
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fs:
+            fs.write(body)
+        os.replace(tmp, path)
+        with open(tmp, "w") as fs:
+            json.dump(meta, fs)
+        os.replace(tmp, path + self.META_SUFFIX)
+
+    def list(self, prefix):
+        keys = []
+        for dirpath, _, filenames in os.walk(self._root):
+            for filename in filenames:
+                if filename.endswith((self.META_SUFFIX, ".tmp")) or filename.startswith("_"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), self._root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        # Same order as S3 listings
+        for key in sorted(keys):
+            yield self.head(key) or {"Key": key}
+
+    def delete(self, keys):
+        for key in keys:
+            for path in (self._path(key), self._path(key) + self.META_SUFFIX):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def invalidate(self, paths):
+        invalidation_id = f"local-{time.time()}"
+        with self._lock, open(os.path.join(self._root, "_invalidations.jsonl"), "a") as fs:
+            fs.write(json.dumps({"id": invalidation_id, "time": time.time(), "paths": paths}) + "\n")
+        return {"Invalidation": {"Id": invalidation_id, "Status": "Completed"}}
+
+    def wait_for_invalidation(self, invalidation_id, **kwargs):
+        pass
+
+
+class CachedStorage:
+    # Reads through the tiered cache (see cache.py) and writes through it. Content addressed keys
+    # never change, so a cached copy is served without asking S3; any other key is fetched with
+    # If-None-Match and served from the cache on a 304. Everything else is passed through.
+    def __init__(self, storage, cache=None):
+        self._storage = storage
+        self._cache = cache or get_cache()
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    def _cache_key(self, key):
+        return f"s3:{self._storage.bucket}/{key}"
+
+    def get(self, key):
+        cache_key = self._cache_key(key)
+        cached = self._cache.get(cache_key)
+        if cached is not None and CONTENT_ADDRESSED_KEY_PATTERN.search(key):
+            return cached[0]
+        status, body, etag = self._storage.get_conditional(key, cached[1] if cached else None)
+        if status == 304:
+            return cached[0]
+        if cached is not None:
+            self._cache.invalidate(cache_key, stale=True)
+        if status == 404:
+            return None
+        self._cache.put(cache_key, body, etag)
+        return body
+
+    def get_conditional(self, key, etag=None):
+        return self._storage.get_conditional(key, etag)
+
+    def put(self, key, body, content_type, **extra):
+        cache_key = self._cache_key(key)
+        # Dropped first so a failed write never leaves the old body cached
+        self._cache.invalidate(cache_key)
+        self._storage.put(key, body, content_type, **extra)
+        # Single part uploads have the md5 of the body as their ETag, so the next read of what we
+        # just wrote (this run or the next warm one) is a 304
+        self._cache.put(cache_key, body, f'"{hashlib.md5(body).hexdigest()}"')
+
+    def delete(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self._cache.invalidate(self._cache_key(key))
+        self._storage.delete(keys)
+
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage():
+    global _STORAGE
+    if _STORAGE is None:
+        with _STORAGE_LOCK:
+            if _STORAGE is None:
+                local_root = os.environ.get(LOCAL_STORAGE_ENV)
+                if local_root:
+                    _STORAGE = LocalStorage(local_root)
+                else:
+                    # S3 goes through the cache unless it is disabled (see cache.CACHE_DIR_ENV)
+                    _STORAGE = CachedStorage(S3Storage()) if get_cache() else S3Storage()
+    return _STORAGE
+
+
+def set_storage(storage):
+    global _STORAGE
+    _STORAGE = storage
+    return storage
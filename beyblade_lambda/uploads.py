@@ -0,0 +1,213 @@
+import contextlib
+import contextvars
+import hashlib
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from beyblade_lambda import metrics, storage
+except ModuleNotFoundError:
+    # To support running for local testing
+    import metrics
+    import storage
+
+
+# Write-behind for a run's S3 writes: puts return as soon as they are queued and up to
+# UPLOAD_WORKERS of them go out at once. Order is only enforced where a reader could notice:
+#
+# - barrier() waits for every write its owner queued, e.g. before metadata.json (which points at
+#   the artifacts) or a manifest (which points at the reports) is written. The owner is the state
+#   being run (see owner()), not the thread: pool threads are reused from one state to the next,
+#   and a state must never wait on (or report the failure of) another state's writes
+# - list and delete wait for their owner's writes, and invalidate for everything queued, so the
+#   CloudFront invalidation always goes out after the metadata it is for
+#
+# A key queued again with the same body is dropped and a newer body supersedes one that hasn't
+# started uploading. Reads of a queued key are answered from the queue.
+#
+#   with uploads.write_behind() as queue:
+#       ...  # get_storage() queues every put
+#   queue.report()
+UPLOAD_WORKERS = 16
+
+_OWNER = contextvars.ContextVar("upload_owner", default=None)
+# flush() without an owner waits for every owner's writes
+_ALL = object()
+
+
+class _Upload:
+    def __init__(self, key, body, content_type, extra, owner):
+        self.key = key
+        self.body = body
+        self.content_type = content_type
+        self.extra = extra
+        self.owner = owner
+        self.md5 = hashlib.md5(body).hexdigest()
+        self.future = None
+
+
+class QueuedStorage:
+    # Same interface as the storage it wraps (see storage.py), with put queued
+    def __init__(self, storage, max_workers=UPLOAD_WORKERS):
+        self._storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        # Reentrant: cancelling a superseded upload runs its done callback right away
+        self._lock = threading.RLock()
+        # key -> the latest _Upload queued for it, until it is done
+        self._pending = {}
+        self._uploads = []
+        self._stats = {"Uploads": 0, "Deduplicated": 0, "Superseded": 0, "Failed": 0, "BytesOut": 0}
+        self._upload_seconds = 0.0
+        self._busy_since = None
+        self._busy_seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    ## Queue ##
+
+    def _run(self, upload, previous):
+        if previous is not None:
+            # The same key is only ever written in the order it was queued
+            wait([previous.future])
+        start = time.perf_counter()
+        try:
+            self._storage.put(upload.key, upload.body, upload.content_type, **upload.extra)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._upload_seconds += elapsed
+            metrics.add("write_behind", Duration=elapsed * 1000, BytesOut=len(upload.body), Uploads=1)
+
+    def _done(self, upload, future):
+        with self._lock:
+            if self._pending.get(upload.key) is upload:
+                del self._pending[upload.key]
+            if future.cancelled():
+                self._stats["Superseded"] += 1
+            elif future.exception() is not None:
+                self._stats["Failed"] += 1
+            else:
+                self._stats["Uploads"] += 1
+                self._stats["BytesOut"] += len(upload.body)
+            if not any(not u.future.done() for u in self._pending.values()) and self._busy_since is not None:
+                self._busy_seconds += time.perf_counter() - self._busy_since
+                self._busy_since = None
+
+    def put(self, key, body, content_type, **extra):
+        upload = _Upload(key, body, content_type, extra, _OWNER.get())
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None and previous.md5 == upload.md5 and previous.extra == extra:
+                self._stats["Deduplicated"] += 1
+                return
+            if previous is not None and previous.future.cancel():
+                previous = None
+            if self._busy_since is None:
+                self._busy_since = time.perf_counter()
+            self._pending[key] = upload
+            self._uploads.append(upload)
+            # Run in the caller's metrics scope, so uploads are counted against their state
+            context = contextvars.copy_context()
+            upload.future = self._executor.submit(context.run, self._run, upload, previous)
+        upload.future.add_done_callback(lambda future: self._done(upload, future))
+
+    def flush(self, owner=_ALL):
+        # Waits for the uploads queued so far (only `owner`'s, if given) and raises the first
+        # failure among them
+        with self._lock:
+            uploads, rest = [], []
+            for upload in self._uploads:
+                (uploads if owner is _ALL or upload.owner == owner else rest).append(upload)
+            self._uploads = rest
+        wait([u.future for u in uploads])
+        for upload in uploads:
+            if not upload.future.cancelled() and upload.future.exception() is not None:
+                raise upload.future.exception()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+    def report(self):
+        # The time the uploads took one after the other vs the time the queue was busy
+        with self._lock:
+            report = dict(self._stats)
+            report["upload_seconds"] = round(self._upload_seconds, 3)
+            report["wall_seconds"] = round(self._busy_seconds, 3)
+        report["speedup"] = round(report["upload_seconds"] / report["wall_seconds"], 2) if report["wall_seconds"] else None
+        return report
+
+    ## Reads see queued writes ##
+
+    def _queued(self, key):
+        with self._lock:
+            return self._pending.get(key)
+
+    def get(self, key):
+        upload = self._queued(key)
+        return upload.body if upload is not None else self._storage.get(key)
+
+    def get_conditional(self, key, etag=None):
+        upload = self._queued(key)
+        if upload is None:
+            return self._storage.get_conditional(key, etag)
+        queued_etag = f'"{upload.md5}"'
+        return (304, None, etag) if etag == queued_etag else (200, upload.body, queued_etag)
+
+    def head(self, key):
+        upload = self._queued(key)
+        if upload is None:
+            return self._storage.head(key)
+        return {"Key": key, "ETag": f'"{upload.md5}"', "Size": len(upload.body), "LastModified": None}
+
+    ## The rest waits for the queue ##
+
+    def list(self, prefix):
+        self.flush(owner=_OWNER.get())
+        return self._storage.list(prefix)
+
+    def delete(self, keys):
+        self.flush(owner=_OWNER.get())
+        self._storage.delete(keys)
+
+    def invalidate(self, paths):
+        self.flush()
+        return self._storage.invalidate(paths)
+
+
+@contextlib.contextmanager
+def write_behind(max_workers=UPLOAD_WORKERS):
+    # Queues every write made through get_storage() for the duration; everything has been
+    # uploaded when it exits
+    base = storage.get_storage()
+    queue = storage.set_storage(QueuedStorage(base, max_workers=max_workers))
+    try:
+        yield queue
+    finally:
+        try:
+            queue.close()
+        finally:
+            storage.set_storage(base)
+
+
+@contextlib.contextmanager
+def owner(name):
+    # Writes queued in the block (from any thread it hands work to with its context) belong to
+    # `name`, e.g. a state
+    token = _OWNER.set(name)
+    try:
+        yield
+    finally:
+        _OWNER.reset(token)
+
+
+def barrier():
+    # Waits for the writes the current owner queued, before writing something that points at them
+    current = storage.get_storage()
+    if isinstance(current, QueuedStorage):
+        current.flush(owner=_OWNER.get())
@@ -17,26 +17,87 @@ EPI_COLUMNS_NAME_MAP = {
 }
 EPI_COUNTY_OF_INTEREST = "Statewide"
 EPI_DEATHS_FNAME_TMPL = "epi_deaths_data.{md5}.json"
+# Number of days before the latest published day that are re-read on every run, since DOH keeps
+# revising recent days (deaths are attributed to the earliest specimen collection date).
+EPI_REVISION_LOOKBACK_DAYS = 60
+# County series are republished weekly, as reading them converts every row of the worksheet
+# rather than just the Statewide ones
+EPI_AREAS_INTERVAL_DAYS = 7
+
+# See engine.py for what each key means
+EPI_SOURCE = {
+    "name": "epi",
+    "type": "xlsx",
+    "url": EPI_DATA_URL,
+    "sheet": EPI_DEATHS_WORKSHEET_NAME,
+    "columns": EPI_COLUMNS_NAME_MAP,
+    "filters": {"county": EPI_COUNTY_OF_INTEREST},
+    # Every county's series is published too, from the same read every EPI_AREAS_INTERVAL_DAYS
+    "group_by": "county",
+    "areas_interval_days": EPI_AREAS_INTERVAL_DAYS,
+    "date_field": "date",
+    "incremental": True,
+    "splice_fields": ("date", "deaths", "rolling_average"),
+    "lookback_days": EPI_REVISION_LOOKBACK_DAYS,
+    "archive": {"fields": ["date", "deaths", "rolling_average"], "fname": EPI_DEATHS_FNAME_TMPL},
+}
 
 ## BREAKTHROUGH DATA CONSTANTS ##
 BREAKTHROUGH_DATA_URL = "https://doh.wa.gov/sites/default/files/2022-02/420-339-VaccineBreakthroughReport.pdf"
 BREAKTHROUGH_REPORT_FNAME_TMPL = "{date}-420-339-VaccineBreakthroughReport.pdf"
+# Bump whenever the records parsed from the reports change, so every archived report is parsed again
+# 2: dates are Pacific midnight whatever the host's timezone (see dates.py)
+# 3: a field repeated in a report is its last occurrence again (see pdf.FieldExtractor)
+BREAKTHROUGH_MANIFEST_VERSION = 3
+# Patterns are searched for (see pdf.FieldExtractor), so they need no leading/trailing ".*". The
+# last occurrence in a report is the one used, as it was with the ".*"s.
 BREAKTHROUGH_REPORT_DATE_PATTERN = re.compile(
-    r".*Washington State Department of Health\s?\s?([\w]+ [\d]{1,2}, [\d]{4}).*"
+    r"Washington State Department of Health\s?\s?([\w]+ [\d]{1,2}, [\d]{4})"
 )
 BREAKTHROUGH_DATE_PATTERN = re.compile(
-    r".*At a Glance \(\s?data from ([\w]+ [\d]{1,2}, [\d]{4})\s?-?\s?([\w]+ [\d]{1,2}, [\d]{4})\s?\).*"
+    r"At a Glance \(\s?data from ([\w]+ [\d]{1,2}, [\d]{4})\s?-?\s?([\w]+ [\d]{1,2}, [\d]{4})\s?\)"
 )
 BREAKTHROUGH_CASE_COUNT_PATTERN = re.compile(
-    r".*\s([\d,]+)\s+SARS-CoV-2\s?vaccine\s?breakthrough\s?cases\s?have\s?been\s?identified.*"
+    r"\s([\d,]+)\s+SARS-CoV-2\s?vaccine\s?breakthrough\s?cases\s?have\s?been\s?identified"
 )
 BREAKTHROUGH_HOSPITALIZED_PCT_PATTERN = re.compile(
-    r".*\s([\d]{1,2})% were hospitalized.*"
+    r"\s([\d]{1,2})% were hospitalized"
 )
 BREAKTHROUGH_DEATH_COUNT_PATTERN = re.compile(
-    r".*\s([\d]+) people died of COVID-related illness.*"
+    r"\s([\d]+) people died of COVID-related illness"
 )
 BREAKTHROUGH_DEATH_PCT_PATTERN = re.compile(
-    r".*\s([\d\.]{1,3})% died of COVID-related illness.*"
+    r"\s([\d\.]{1,3})% died of COVID-related illness"
 )
+BREAKTHROUGH_FIELDS = {
+    "report_date": BREAKTHROUGH_REPORT_DATE_PATTERN,
+    "dates": BREAKTHROUGH_DATE_PATTERN,
+    "case_count": BREAKTHROUGH_CASE_COUNT_PATTERN,
+    "hospitalized_pct": BREAKTHROUGH_HOSPITALIZED_PCT_PATTERN,
+    "death_count": BREAKTHROUGH_DEATH_COUNT_PATTERN,
+    "death_pct": BREAKTHROUGH_DEATH_PCT_PATTERN,
+}
+# Older reports only give the percentage of breakthrough cases that died
+BREAKTHROUGH_REQUIRED_FIELDS = [
+    ("report_date",),
+    ("dates",),
+    ("case_count",),
+    ("hospitalized_pct",),
+    ("death_count", "death_pct"),
+]
+
+# Timestamp fields of the processed breakthrough records, published as day offsets
+BREAKTHROUGH_DATE_FIELDS = ("date", "report_date", "start_date", "end_date")
+BREAKTHROUGH_REPORT_DATE_FORMAT = "%B %d, %Y"
 
+BREAKTHROUGH_SOURCE = {
+    "name": "breakthrough",
+    "type": "pdf",
+    "url": BREAKTHROUGH_DATA_URL,
+    "fields": BREAKTHROUGH_FIELDS,
+    "required": BREAKTHROUGH_REQUIRED_FIELDS,
+    "date_format": BREAKTHROUGH_REPORT_DATE_FORMAT,
+    "report_fname": BREAKTHROUGH_REPORT_FNAME_TMPL,
+    "manifest_version": BREAKTHROUGH_MANIFEST_VERSION,
+    "date_fields": BREAKTHROUGH_DATE_FIELDS,
+}
@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+try:
+    from beyblade_lambda import dates
+except ModuleNotFoundError:
+    # To support running for local testing
+    import dates
+
+
+# Columnar form of a published series, next to the list of row dicts:
+#   {"format": "columnar", "version": 1, "length": n, "start": "YYYY-MM-DD", "date_fields": [...],
+#    "columns": {field: [v0, v1, ...]}, "sparse": {field: [[row, value], ...]}}
+# Date fields hold day offsets from "start" instead of timestamps and floats are rounded to
+# `precision` places. Fields only some rows have (CA's "undated" marker) go in "sparse".
+WIRE_FORMAT = "columnar"
+WIRE_VERSION = 1
+FLOAT_PRECISION = 3
+
+
+def _day(ts):
+    # Published timestamps are Pacific midnight (see dates.py)
+    return dates.to_day(ts)
+
+
+def _encode_value(value, is_date, start, precision):
+    if value is None:
+        return None
+    if is_date:
+        return (_day(value) - start).days
+    if isinstance(value, float):
+        return round(value, precision)
+    return value
+
+
+def to_columnar(records, date_fields=("date",), fields=None, precision=FLOAT_PRECISION):
+    if fields is None:
+        fields = list(dict.fromkeys(f for r in records for f in r))
+    dates = [_day(r[f]) for r in records for f in date_fields if r.get(f) is not None]
+    start = min(dates) if dates else date(1970, 1, 1)
+
+    columns, sparse = {}, {}
+    for field in fields:
+        is_date = field in date_fields
+        if all(field in r for r in records):
+            columns[field] = [_encode_value(r[field], is_date, start, precision) for r in records]
+        else:
+            sparse[field] = [
+                [i, _encode_value(r[field], is_date, start, precision)] for i, r in enumerate(records) if field in r
+            ]
+    return {
+        "format": WIRE_FORMAT,
+        "version": WIRE_VERSION,
+        "length": len(records),
+        "start": start.isoformat(),
+        "date_fields": [f for f in date_fields if f in fields],
+        "columns": columns,
+        "sparse": sparse,
+    }
+
+
+def from_columnar(payload):
+    # Inverse of to_columnar
+    if payload.get("format") != WIRE_FORMAT or payload.get("version") != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire format {payload.get('format')} v{payload.get('version')}")
+    start = date.fromisoformat(payload["start"])
+    date_fields = set(payload["date_fields"])
+    records = [{} for _ in range(payload["length"])]
+
+    def decode(field, value):
+        if value is None or field not in date_fields:
+            return value
+        return dates.day_timestamp(start + timedelta(days=value))
+
+    for field, values in payload["columns"].items():
+        for record, value in zip(records, values):
+            record[field] = decode(field, value)
+    for field, entries in payload["sparse"].items():
+        for i, value in entries:
+            records[i][field] = decode(field, value)
+    return records
@@ -0,0 +1,151 @@
+import posixpath
+import re
+import zipfile
+
+from datetime import datetime, timedelta
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+
+try:
+    from beyblade_lambda import metrics
+    from beyblade_lambda.exceptions import ParseError
+except ModuleNotFoundError:
+    # To support running for local testing
+    import metrics
+    from exceptions import ParseError
+
+
+# A minimal reader for the one thing we need from the DOH workbooks: the values of a few columns
+# of a single worksheet. It streams the worksheet XML straight out of the zip and never builds
+# cell objects, so memory stays flat regardless of the size of the sheet.
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+CELL_REF_PATTERN = re.compile(r"([A-Z]+)")
+EXCEL_EPOCH = datetime(1899, 12, 30)
+EXCEL_1904_EPOCH = datetime(1904, 1, 1)
+
+
+def _column_index(ref):
+    index = 0
+    for char in CELL_REF_PATTERN.match(ref).group(1):
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+def _cast_number(value):
+    # Same rules as openpyxl, so both readers produce identical records
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def from_excel(value, epoch=EXCEL_EPOCH):
+    days = float(value)
+    return epoch + timedelta(days=days)
+
+
+def _iter_elements(archive, path, tag):
+    # Yields every `tag` element once it's complete and then throws it away
+    with archive.open(path) as xml:
+        for _, elem in iterparse(xml, events=("end",)):
+            if elem.tag == tag:
+                yield elem
+                elem.clear()
+
+
+def _worksheet_path(archive, sheet_name):
+    workbook = archive.read("xl/workbook.xml")
+    rels = archive.read("xl/_rels/workbook.xml.rels")
+    rel_id, epoch = None, EXCEL_EPOCH
+    for _, elem in iterparse(BytesIO(workbook)):
+        if elem.tag == f"{MAIN_NS}workbookPr" and elem.get("date1904") in ("1", "true"):
+            epoch = EXCEL_1904_EPOCH
+        if elem.tag == f"{MAIN_NS}sheet" and elem.get("name") == sheet_name:
+            rel_id = elem.get(f"{REL_NS}id")
+    if rel_id is None:
+        raise ParseError(f"Worksheet {sheet_name} not found")
+    for _, elem in iterparse(BytesIO(rels)):
+        if elem.tag == f"{PKG_REL_NS}Relationship" and elem.get("Id") == rel_id:
+            target = elem.get("Target")
+            if target.startswith("/"):
+                return target.lstrip("/"), epoch
+            return posixpath.normpath(posixpath.join("xl", target)), epoch
+    raise ParseError(f"Worksheet {sheet_name} has no relationship {rel_id}")
+
+
+def _shared_strings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    for si in _iter_elements(archive, "xl/sharedStrings.xml", f"{MAIN_NS}si"):
+        # Rich text is split over several <t> runs
+        strings.append("".join(t.text or "" for t in si.iter(f"{MAIN_NS}t")))
+    return strings
+
+
+def _cell_value(cell, strings):
+    cell_type = cell.get("t", "n")
+    if cell_type == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(f"{MAIN_NS}t"))
+    value = cell.findtext(f"{MAIN_NS}v")
+    if value is None:
+        return None
+    if cell_type == "s":
+        return strings[int(value)]
+    if cell_type == "n":
+        return _cast_number(value)
+    if cell_type == "b":
+        return value == "1"
+    if cell_type == "d":
+        return datetime.fromisoformat(value)
+    return value
+
+
+def read_sheet_records(content, sheet_name, column_map, filters=None, date_fields=()):
+    # Yields {field: value} for every row after the header whose values match `filters`.
+    # `column_map` maps header text to field name; only those columns are ever converted.
+    # Fields in `date_fields` hold excel serial dates and are converted to naive datetimes.
+    scanned, kept = 0, 0
+    try:
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            path, epoch = _worksheet_path(archive, sheet_name)
+            strings = _shared_strings(archive)
+            fields, filter_columns = None, []
+            for row in _iter_elements(archive, path, f"{MAIN_NS}row"):
+                cells, position = {}, 0
+                for cell in row.iter(f"{MAIN_NS}c"):
+                    ref = cell.get("r")
+                    position = _column_index(ref) if ref else position
+                    if fields is None or position in fields:
+                        cells[position] = cell
+                    position += 1
+
+                if fields is None:
+                    headers = {i: _cell_value(c, strings) for i, c in cells.items()}
+                    fields = {i: column_map[h] for i, h in headers.items() if h in column_map}
+                    if not fields:
+                        fields = None
+                        continue
+                    by_field = {field: i for i, field in fields.items()}
+                    filter_columns = [(by_field[k], v) for k, v in (filters or {}).items()]
+                    continue
+
+                scanned += 1
+                if any(i not in cells or _cell_value(cells[i], strings) != v for i, v in filter_columns):
+                    continue
+                record = {}
+                for i, field in fields.items():
+                    value = _cell_value(cells[i], strings) if i in cells else None
+                    if field in date_fields and isinstance(value, (int, float)):
+                        value = from_excel(value, epoch)
+                    record[field] = value
+                kept += 1
+                yield record
+    finally:
+        metrics.add("parse", RowsScanned=scanned, RowsKept=kept)
+
+    if fields is None:
+        raise ParseError(f"No header row with columns {list(column_map)} in worksheet {sheet_name}")
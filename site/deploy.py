@@ -1,16 +1,25 @@
 #!/usr/bin/env python
+import argparse
 import base64
 import hashlib
 import os
 import time
 import mimetypes
 import boto3 as boto
-from io import BytesIO
+
+from concurrent.futures import ThreadPoolExecutor
 
 
 BEYBLADE_S3_BUCKET = "beybla.de"
 CLOUDFRONT_DISTRIBUTION = "E28YRVB5CTBVQT"
 
+# Keys in the bucket that are not part of the site (the lambda's data, fonts uploaded by hand) are
+# never deleted, however the local tree looks.
+UNMANAGED_PREFIXES = ("static/", "fonts/")
+UPLOAD_WORKERS = 8
+# Past this many changed paths a single "/*" invalidation is cheaper
+MAX_INVALIDATION_PATHS = 15
+
 
 def list_dir(tdir):
     files = []
@@ -26,19 +35,89 @@ def list_dir(tdir):
     return files
 
 
-def upload_files(files):
-    client = boto.client("s3")
+def local_md5s(files):
+    md5s = {}
     for file in files:
         with open(file, "rb") as fs:
-            data = fs.read()
-        upload_md5 = base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
-        client.put_object(
-            ACL="private",
+            md5s[file] = hashlib.md5(fs.read()).hexdigest()
+    return md5s
+
+
+def _add_etags(etags, page):
+    for obj in page.get("Contents", []):
+        etags[obj["Key"]] = obj["ETag"].strip('"')
+
+
+def remote_etags(client):
+    # The top level is listed on its own and then every prefix under it except the unmanaged
+    # ones, so the lambda's data is never paged through
+    etags, prefixes = {}, []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BEYBLADE_S3_BUCKET, Delimiter="/"):
+        _add_etags(etags, page)
+        prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    for prefix in prefixes:
+        if prefix.startswith(UNMANAGED_PREFIXES):
+            continue
+        for page in paginator.paginate(Bucket=BEYBLADE_S3_BUCKET, Prefix=prefix):
+            _add_etags(etags, page)
+    return etags
+
+
+def plan_sync(local, remote, delete=False):
+    # For single part uploads the ETag is the hex md5 of the body. Multipart ETags ("<md5>-<n>")
+    # never match so those files are simply uploaded again.
+    changed = sorted(f for f, md5 in local.items() if remote.get(f) != md5)
+    removed = []
+    if delete:
+        removed = sorted(
+            k for k in remote
+            if k not in local and not k.startswith(UNMANAGED_PREFIXES) and not k.endswith("/")
+        )
+    return changed, removed
+
+
+def upload_file(client, file):
+    with open(file, "rb") as fs:
+        data = fs.read()
+    upload_md5 = base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
+    client.put_object(
+        ACL="private",
+        Bucket=BEYBLADE_S3_BUCKET,
+        Key=file,
+        Body=data,
+        ContentMD5=upload_md5,
+        ContentType=mimetypes.guess_type(file)[0] or "application/octet-stream"
+    )
+    return file
+
+
+def upload_files(files, client=None, workers=UPLOAD_WORKERS):
+    client = client or boto.client("s3")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for file in executor.map(lambda f: upload_file(client, f), files):
+            print(f"  uploaded {file}")
+
+
+def delete_files(files, client=None):
+    client = client or boto.client("s3")
+    for i in range(0, len(files), 1000):
+        client.delete_objects(
             Bucket=BEYBLADE_S3_BUCKET,
-            Key=file,
-            Body=data,
-            ContentType=mimetypes.guess_type(file)[0]
+            Delete={"Objects": [{"Key": k} for k in files[i:i + 1000]], "Quiet": True}
         )
+    for file in files:
+        print(f"  deleted {file}")
+
+
+def invalidation_paths(files):
+    paths = [f"/{p}" for p in files]
+    # The distribution serves index.html for the bare domain
+    if "index.html" in files:
+        paths.append("/")
+    if len(paths) > MAX_INVALIDATION_PATHS:
+        return ["/*"]
+    return sorted(paths)
 
 
 def invalidate_cloudfront_paths(paths):
@@ -55,17 +134,39 @@ def invalidate_cloudfront_paths(paths):
     )
 
 
-def main():
+def main(delete=False, dry_run=False, workers=UPLOAD_WORKERS, invalidate=True):
+    start = time.monotonic()
     cwd = os.getcwd()
-    # This could get limited to only those files that have changed
-    print("Finding files to upload...")
-    files_to_upload = list_dir(cwd)
-    print("Uploading files...")
-    upload_files(files_to_upload)
-    print("Invalidating files in Cloudfront...")
-    invalidate_cloudfront_paths([f"/{p}" for p in files_to_upload])
-    print("Done!")
+    client = boto.client("s3")
+    print("Comparing local files with the bucket...")
+    local = local_md5s(list_dir(cwd))
+    changed, removed = plan_sync(local, remote_etags(client), delete=delete)
+    print(f"{len(changed)} changed, {len(removed)} removed, {len(local) - len(changed)} unchanged")
+    if dry_run:
+        for file in changed:
+            print(f"  would upload {file}")
+        for file in removed:
+            print(f"  would delete {file}")
+        return
+
+    if changed:
+        print("Uploading changed files...")
+        upload_files(changed, client=client, workers=workers)
+    if removed:
+        print("Deleting removed files...")
+        delete_files(removed, client=client)
+    if invalidate and (changed or removed):
+        paths = invalidation_paths(changed + removed)
+        print(f"Invalidating {paths} in Cloudfront...")
+        invalidate_cloudfront_paths(paths)
+    print(f"Done in {time.monotonic() - start:.1f}s!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Sync the site to S3, uploading only changed files")
+    parser.add_argument("--delete", action="store_true", help="delete files from the bucket that no longer exist locally")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would change")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    parser.add_argument("--no-invalidate", dest="invalidate", action="store_false")
+    args = parser.parse_args()
+    main(delete=args.delete, dry_run=args.dry_run, workers=args.workers, invalidate=args.invalidate)
@@ -4,9 +4,127 @@ $.BEYBLADE = {
   metadata: {},
   supportedStates: [],
   chart: null,
+  // Pre-compressed copies the lambda publishes next to each data file, most preferred first
+  encodingSuffixes: [["br", ".br"], ["gzip", ".gz"]],
+  dataUrl: function(section) {
+    var encodings = section["encodings"] || [];
+    for (var i = 0; i < this.encodingSuffixes.length; i++) {
+      if (encodings.indexOf(this.encodingSuffixes[i][0]) !== -1) {
+        return section["url"] + this.encodingSuffixes[i][1];
+      }
+    }
+    return section["url"];
+  },
+  // Columnar wire format versions this page can decode
+  wireVersions: [1],
+  sectionSource: function(section) {
+    // Prefers the columnar form of a series when the lambda published one we understand
+    var columnar = section["columnar"];
+    if (columnar && this.wireVersions.indexOf(columnar["version"]) !== -1) {
+      return {url: this.dataUrl(columnar), columnar: true};
+    }
+    return {url: this.dataUrl(section), columnar: false};
+  },
+  decodeColumnar: function(payload) {
+    // Rebuilds the list of rows, date fields back to unix timestamps
+    var start = moment(payload["start"], "YYYY-MM-DD");
+    var dateFields = payload["date_fields"];
+    var rows = [];
+    for (var i = 0; i < payload["length"]; i++) {
+      rows.push({});
+    }
+    var decode = function(field, value) {
+      if (value === null || dateFields.indexOf(field) === -1) {
+        return value;
+      }
+      return start.clone().add(value, "days").unix();
+    };
+    $.each(payload["columns"], function(field, values) {
+      for (var i = 0; i < values.length; i++) {
+        rows[i][field] = decode(field, values[i]);
+      }
+    });
+    $.each(payload["sparse"], function(field, entries) {
+      for (var i = 0; i < entries.length; i++) {
+        rows[entries[i][0]][field] = decode(field, entries[i][1]);
+      }
+    });
+    return rows;
+  },
+  fetchSeries: function(source) {
+    return $.getJSON(source["url"]).then(function(data) {
+      return source["columnar"] ? $.BEYBLADE.decodeColumnar(data) : data;
+    });
+  },
   fetchSupportedStates: function() {
     this.supportedStates = ["CA", "WA"];
   },
+  indexUrl: "https://beybla.de/static/data/index.json",
+  bundleVersions: [1],
+  index: null,
+  loading: {},
+  fetchIndex: function() {
+    // Resolves to null when the index can't be loaded so states fall back to metadata.json
+    if (!this.index) {
+      this.index = $.getJSON(this.indexUrl).then(
+        function(index) { return index; },
+        function() { return null; }
+      );
+    }
+    return this.index;
+  },
+  loadState: function(state) {
+    // One request for the index (shared by every state) and one for the state's bundle
+    if (!(state in this.loading)) {
+      this.loading[state] = this.fetchIndex().then(function(index) {
+        var entry = index && index["states"][state];
+        var bundle = entry && entry["bundle"];
+        if (bundle && $.BEYBLADE.bundleVersions.indexOf(bundle["version"]) !== -1) {
+          return $.getJSON($.BEYBLADE.dataUrl(bundle)).then(function(data) {
+            $.BEYBLADE.applyBundle(state, data);
+          });
+        }
+        return $.BEYBLADE.loadStateFromMetadata(state);
+      });
+    }
+    return this.loading[state];
+  },
+  applyBundle: function(state, bundle) {
+    this.metadata[state] = {
+      stateLabel: bundle["state_label"],
+      humanLabel: bundle["human_label"]
+    };
+    this.data[state] = {
+      epi: this.decodeColumnar(bundle["epi"]["data"]),
+      breakthrough: this.decodeColumnar(bundle["breakthrough"]["data"])
+    };
+  },
+  loadStateFromMetadata: function(state) {
+    var metadata = {};
+    var data = {};
+    return $.getJSON("https://beybla.de/static/data/" + state + "/metadata.json").then(function(meta) {
+      metadata["stateLabel"] = meta["state_label"];
+      metadata["humanLabel"] = meta["human_label"];
+      return $.when(
+        $.BEYBLADE.fetchSeries($.BEYBLADE.sectionSource(meta["epi"])),
+        $.BEYBLADE.fetchSeries($.BEYBLADE.sectionSource(meta["breakthrough"]))
+      );
+    })
+    .then(function(epi_data, breakthrough_data) {
+      data["epi"] = epi_data;
+      data["breakthrough"] = breakthrough_data;
+      $.BEYBLADE.metadata[state] = metadata;
+      $.BEYBLADE.data[state] = data;
+    });
+  },
+  prefetchStates: function() {
+    // Once the index is in, every other supported state loads in the background
+    this.fetchIndex().then(function() {
+      $.each($.BEYBLADE.supportedStates, function(i, state) {
+        $.BEYBLADE.loadState(state.toLowerCase());
+      });
+    });
+  },
   fetchStateData: function(state) {
     this.selectedState = state;
     if (state in this.data) {
@@ -14,27 +132,11 @@ $.BEYBLADE = {
       return;
     }
 
-    this.data[state] = {};
-    this.metadata[state] = {};
-    return $.getJSON("https://beybla.de/static/data/" + state + "/metadata.json", function(data) {
-      $.BEYBLADE.metadata[state]["stateLabel"] = data["state_label"];
-      $.BEYBLADE.metadata[state]["humanLabel"] = data["human_label"];
-      $.BEYBLADE.metadata[state]["epi_url"] = data["epi"]["url"];
-      $.BEYBLADE.metadata[state]["breakthrough_url"] = data["breakthrough"]["url"];
-
-    })
-    .then(function() {
-      $.getJSON($.BEYBLADE.metadata[state]["epi_url"], function(epi_data) {
-        $.BEYBLADE.data[state]["epi"] = epi_data;
-      })
-      .then(function() {
-        $.getJSON($.BEYBLADE.metadata[state]["breakthrough_url"], function(breakthrough_data) {
-          $.BEYBLADE.data[state]["breakthrough"] = breakthrough_data;
-        })
-        .then(function() {
-          $.BEYBLADE.refreshDisplay();
-        });
-      });
+    return this.loadState(state).then(function() {
+      // Another state may have been picked while this one was loading
+      if ($.BEYBLADE.selectedState === state) {
+        $.BEYBLADE.refreshDisplay();
+      }
     });
   },
   refreshDisplay: function() {
@@ -172,5 +274,6 @@ $(document).ready(function(){
   } else {
     $.BEYBLADE.fetchStateData("wa");
   }
+  $.BEYBLADE.prefetchStates();
 
 });
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from beyblade_lambda import artifacts, bench, ca, runner
+from beyblade_lambda.lib import get_processed_data
+
+
+CONFIG = ca.CONFIG
+STALE = [
+    f"{CONFIG.get_processed_data_prefix()}/epi_{'0' * 32}.json",
+    f"{CONFIG.get_epi_data_prefix()}epi_{'1' * 32}.json.gz",
+]
+LATER = datetime.now(timezone.utc) + timedelta(days=artifacts.GC_GRACE_DAYS + 1)
+
+
+@pytest.fixture
+def published(tmp_path, capsys):
+    # A bucket after one run of the pipeline plus artifacts no metadata.json points at
+    bench.synthesize_fixtures(str(tmp_path), scale=1)
+    fixtures = bench.load_fixtures(str(tmp_path))
+    with bench.replay_sources(fixtures), bench.local_storage(fixtures) as local:
+        runner.main()
+        for key in STALE:
+            local.put(key, b"{}", "application/json")
+        yield local, get_processed_data(CONFIG.get_processed_metadata_key())
+
+
+def _keys(local):
+    return [obj["Key"] for prefix in CONFIG.get_artifact_prefixes() for obj in local.list(prefix)]
+
+
+def test_referenced_keys_are_kept(published):
+    local, metadata = published
+    referenced = artifacts.referenced_keys(metadata)
+    assert referenced and all(local.head(key) is not None for key in referenced)
+
+    report = artifacts.collect_garbage(CONFIG, metadata, dry_run=False, storage=local, now=LATER)
+
+    assert sorted(report["unreferenced"]) == sorted(STALE)
+    assert all(local.head(key) is None for key in STALE)
+    assert all(local.head(key) is not None for key in referenced)
+
+
+def test_grace_period_is_honored(published):
+    local, metadata = published
+
+    report = artifacts.collect_garbage(CONFIG, metadata, dry_run=False, storage=local)
+
+    assert report["unreferenced"] == []
+    assert report["within_grace_period"] == len(STALE)
+    assert all(local.head(key) is not None for key in STALE)
+
+
+def test_dry_run_deletes_nothing(published):
+    local, metadata = published
+    before = _keys(local)
+
+    report = artifacts.collect_garbage(CONFIG, metadata, storage=local, now=LATER)
+
+    assert report["dry_run"]
+    assert sorted(report["unreferenced"]) == sorted(STALE)
+    assert report["bytes_freed"] == 2 * len(STALE)
+    assert _keys(local) == before
@@ -0,0 +1,151 @@
+import pytest
+
+from beyblade_lambda import bench
+from beyblade_lambda.cache import TieredCache
+from beyblade_lambda.fetch import ConditionalFetch, get_session
+
+
+SOURCE_URL = "https://source.test/data.csv"
+SOURCE = b"date,deaths\n2022-01-01,1\n" * 100
+
+
+def _body(name, size=20):
+    return name.encode("utf-8").ljust(size, b".")
+
+
+def _fill(cache, names):
+    for name in names:
+        cache.put(name, _body(name), {"etag": name})
+
+
+def test_memory_evicts_least_recently_used():
+    cache = TieredCache(memory_bytes=100)
+    _fill(cache, "abcde")
+    assert cache.get("a") == (_body("a"), {"etag": "a"})
+
+    _fill(cache, "f")
+
+    assert cache.get("b") is None
+    assert [cache.get(name) is not None for name in "acdef"] == [True] * 5
+    assert cache.stats()["Evictions"] == 1
+    assert cache.stats()["MemoryBytes"] == 100
+
+
+def test_memory_skips_large_entries():
+    cache = TieredCache(memory_bytes=100)
+    cache.put("large", _body("large", 30), None)
+    assert cache.get("large") is None
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    cache = TieredCache(str(tmp_path), memory_bytes=0, disk_bytes=100)
+    _fill(cache, "abcde")
+    assert cache.get("a") == (_body("a"), {"etag": "a"})
+
+    _fill(cache, "f")
+
+    assert cache.get("b") is None
+    assert cache.version("a") == {"etag": "a"}
+    assert cache.stats()["Evictions"] == 1
+    assert cache.stats()["DiskBytes"] == 100
+    # The body and its metadata are both gone
+    assert len(list(tmp_path.iterdir())) == 10
+
+
+def test_disk_entries_outlive_the_process(tmp_path):
+    _fill(TieredCache(str(tmp_path)), "ab")
+
+    cache = TieredCache(str(tmp_path))
+
+    assert cache.get("a") == (_body("a"), {"etag": "a"})
+    assert cache.stats()["DiskHits"] == 1
+    assert cache.get("a") is not None
+    assert cache.stats()["MemoryHits"] == 1
+
+
+def test_invalidate_drops_both_tiers(tmp_path):
+    cache = TieredCache(str(tmp_path))
+    _fill(cache, "ab")
+
+    cache.invalidate("a")
+    cache.invalidate("b", stale=True)
+    cache.invalidate("missing")
+
+    assert cache.get("a") is None and cache.get("b") is None
+    assert TieredCache(str(tmp_path)).get("a") is None
+    stats = cache.stats()
+    assert (stats["Invalidations"], stats["Stale"]) == (1, 1)
+    assert (stats["MemoryBytes"], stats["DiskBytes"]) == (0, 0)
+
+
+def test_writer_streams_to_disk(tmp_path):
+    cache = TieredCache(str(tmp_path))
+    writer = cache.writer("streamed", None)
+    for chunk in (b"abc", b"def", b"g"):
+        writer.write(chunk)
+    writer.commit({"md5": "x"})
+
+    aborted = cache.writer("aborted", None)
+    aborted.write(b"abc")
+    aborted.abort()
+
+    assert list(cache.iter_chunks("streamed", chunk_size=3)) == [b"abc", b"def", b"g"]
+    assert cache.version("streamed") == {"md5": "x"}
+    assert cache.version("aborted") is None
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_iter_chunks_misses_evicted_entry(tmp_path):
+    cache = TieredCache(str(tmp_path), memory_bytes=0)
+    _fill(cache, "a")
+    (tmp_path / cache._name("a")).unlink()
+
+    assert list(cache.iter_chunks("a")) == []
+    assert cache.stats()["Misses"] == 1
+
+
+class EvictingCache(TieredCache):
+    # Evicts an entry right after its version is read, like a concurrent fetch filling the cache
+    def version(self, key):
+        version = super().version(key)
+        self.invalidate(key)
+        return version
+
+
+@pytest.fixture
+def replay():
+    session = get_session()
+    session.mount(SOURCE_URL, bench._replay_adapter(SOURCE))
+    try:
+        yield
+    finally:
+        session.adapters.pop(SOURCE_URL, None)
+
+
+def test_fetch_answers_304_from_cache(replay, tmp_path):
+    cache = TieredCache(str(tmp_path))
+    assert ConditionalFetch(SOURCE_URL, cache=cache).content() == SOURCE
+
+    # The metadata of the first run was never saved, so the cached copy is still to be processed
+    fetch = ConditionalFetch(SOURCE_URL, cache=cache)
+    assert fetch.content() == SOURCE
+    assert (fetch.status_code, fetch.from_cache, fetch.bytes_read) == (304, True, 0)
+
+    fetch = ConditionalFetch(SOURCE_URL, previous=fetch.validators, cache=cache)
+    assert fetch.content() is None
+    assert fetch.unchanged
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_fetch_downloads_evicted_copy_again(replay, tmp_path, streamed):
+    first = ConditionalFetch(SOURCE_URL, cache=TieredCache())
+    first.content()
+    cache = EvictingCache(str(tmp_path))
+    cache.put(f"url:{SOURCE_URL}", SOURCE, dict(first.validators))
+
+    fetch = ConditionalFetch(SOURCE_URL, cache=cache)
+    content = b"".join(fetch.iter_content()) if streamed else fetch.content()
+
+    assert content == SOURCE
+    assert (fetch.status_code, fetch.from_cache, fetch.bytes_read) == (200, False, len(SOURCE))
+    assert fetch.validators["md5"] == first.validators["md5"]
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from beyblade_lambda import engine, profiling, runner
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only imported once a state needs them
+DEFERRED = {"openpyxl", "PyPDF2", "requests", "boto3"}
+STATES = {"beyblade_lambda.ca", "beyblade_lambda.wa"}
+
+
+def _imported(module):
+    return profiling.imported_modules(profiling.import_time_report(module, cwd=ROOT))
+
+
+def test_runner_defers_states_and_heavy_imports():
+    assert not (DEFERRED | STATES) & _imported("beyblade_lambda.runner")
+
+
+@pytest.mark.parametrize("state", ["beyblade_lambda.ca", "beyblade_lambda.wa"])
+def test_states_defer_heavy_imports(state):
+    imported = _imported(state)
+    assert state in imported
+    assert not DEFERRED & imported
+
+
+def test_declared_costs_match_the_sources(monkeypatch):
+    for state, entry in runner.STATES.items():
+        assert entry["cost"] == engine.state_cost(runner.load_state(state).STATE)
+
+    # Scheduling reads the registry only, never a state's module
+    def load_state(state):
+        raise AssertionError(f"{state} imported to schedule it")
+
+    monkeypatch.setattr(runner, "load_state", load_state)
+    assert runner.schedule(["ca", "wa"]) == ["wa", "ca"]
@@ -0,0 +1,47 @@
+import csv
+import io
+
+import pytest
+
+from beyblade_lambda.fetch import _iter_decoded_lines, stream_csv_records
+
+
+TEXT = 'date,area,deaths\r\n2022-01-01,"a,\nb",1\n2022-01-02,z\x1ew,2\r2022-01-03, \x85\x0c,3\n2022-01-04,é,4'
+
+
+class Fetch:
+    def __init__(self, content, chunk_size):
+        self.content = content
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.content), self.chunk_size):
+            yield self.content[i:i + self.chunk_size]
+
+
+def _chunks(content, size):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1024])
+def test_lines_only_end_at_newlines(size):
+    content = TEXT.encode("utf-8")
+    lines = list(_iter_decoded_lines(_chunks(content, size)))
+
+    assert "".join(lines) == TEXT
+    assert lines == io.StringIO(TEXT, newline="").readlines()
+
+
+@pytest.mark.parametrize("size", [1, 5, 1024])
+def test_rows_match_csv_reader(size):
+    expected = list(csv.reader(io.StringIO(TEXT, newline="")))
+    records = list(stream_csv_records(None, ["date", "area", "deaths"], fetch=Fetch(TEXT.encode("utf-8"), size)))
+
+    assert [[r["date"], r["area"], r["deaths"]] for r in records] == expected[1:]
+    assert records[1]["area"] == "z\x1ew"
+
+
+def test_filters_on_fields_with_separators():
+    fetch = Fetch(TEXT.encode("utf-8"), 4)
+    records = list(stream_csv_records(None, ["date", "area"], filters={"area": "z\x1ew"}, fetch=fetch))
+    assert records == [{"date": "2022-01-02", "area": "z\x1ew"}]
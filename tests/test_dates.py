@@ -0,0 +1,52 @@
+import time
+from datetime import date, datetime
+
+import pytest
+
+from beyblade_lambda import dates
+
+
+# Pacific midnight of each day: the start and end of daylight saving time and either side of it
+MIDNIGHTS = {
+    "2021-01-01": 1609488000,
+    "2021-03-14": 1615708800,
+    "2021-07-01": 1625122800,
+    "2021-11-07": 1636268400,
+}
+
+
+@pytest.fixture(params=["UTC", "America/Los_Angeles", "America/New_York", "Asia/Tokyo", "Pacific/Kiritimati"])
+def host_tz(request, monkeypatch):
+    # Runs the test as if the host were in each zone, with nothing memoized from another one
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    monkeypatch.setattr(dates, "_MEMOS", {})
+    try:
+        yield request.param
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_dates_are_pacific_midnight(host_tz):
+    convert = dates.converter("%Y-%m-%d")
+    assert {value: convert(value) for value in MIDNIGHTS} == MIDNIGHTS
+    # Naive datetimes, as read from xlsx
+    assert dates.to_timestamp(datetime(2021, 7, 1)) == MIDNIGHTS["2021-07-01"]
+    assert dates.to_timestamp("07/01/2021", "%m/%d/%Y") == MIDNIGHTS["2021-07-01"]
+
+
+def test_days_round_trip(host_tz):
+    for value, ts in MIDNIGHTS.items():
+        day = date.fromisoformat(value)
+        assert dates.to_day(ts) == day
+        assert dates.day_timestamp(day) == ts
+        # Any time of the day is still on it, even the shortest one
+        assert dates.to_day(ts + 22 * 3600) == day
+
+
+def test_add_days_crosses_daylight_saving_time(host_tz):
+    assert dates.add_days(MIDNIGHTS["2021-03-14"], -1) == MIDNIGHTS["2021-03-14"] - 24 * 3600
+    assert dates.add_days(MIDNIGHTS["2021-03-14"], 1) == MIDNIGHTS["2021-03-14"] + 23 * 3600
+    assert dates.add_days(MIDNIGHTS["2021-11-07"], 1) == MIDNIGHTS["2021-11-07"] + 25 * 3600
+    assert dates.add_days(MIDNIGHTS["2021-01-01"], 181) == MIDNIGHTS["2021-07-01"]
@@ -0,0 +1,169 @@
+import copy
+
+from datetime import date, timedelta
+
+from beyblade_lambda import ca, dates, engine, incremental, wa
+
+
+START = date(2022, 1, 1)
+LOOKBACK_DAYS = 30
+
+
+def _day(i):
+    return dates.day_timestamp(START + timedelta(days=i))
+
+
+def _ca_rows(days, undated=3):
+    rows = [{"date": _day(i), "deaths": i % 11} for i in range(days)]
+    return rows + [{"date": None, "deaths": undated}]
+
+
+def _published(records):
+    # What a later run gets back from S3
+    return copy.deepcopy(records)
+
+
+def _tail(rows, previous):
+    cutoff = incremental.revision_cutoff(previous, LOOKBACK_DAYS)
+    return [r for r in rows if r["date"] is None or r["date"] >= cutoff]
+
+
+def _ca_spliced(rows, previous):
+    return engine.derive_cumulative(ca._epi_series(_tail(rows, previous), _published(previous)))
+
+
+def _ca_full(rows):
+    return engine.derive_cumulative(ca._epi_series(copy.deepcopy(rows)))
+
+
+def test_splice_reuses_unchanged_records():
+    previous = [{"date": _day(i), "deaths": i} for i in range(10)]
+    tail = [{"date": _day(i), "deaths": i} for i in range(6, 11)]
+    tail[2]["deaths"] = 100
+
+    merged, changed = incremental.splice(previous, tail)
+
+    assert changed == 8
+    assert [r["deaths"] for r in merged] == [0, 1, 2, 3, 4, 5, 6, 7, 100, 9, 10]
+    assert all(merged[i] is previous[i] for i in range(changed))
+
+
+def test_splice_without_tail_keeps_previous():
+    previous = [{"date": _day(i), "deaths": i} for i in range(3)]
+    assert incremental.splice(previous, []) == (previous, 3)
+
+
+def test_splice_compares_every_field():
+    previous = [{"date": _day(i), "deaths": 1, "rolling_average": 1.0} for i in range(3)]
+    tail = [dict(r) for r in previous]
+    tail[1]["rolling_average"] = 2.0
+
+    assert incremental.splice(previous, tail)[1] == 3
+    assert incremental.splice(previous, tail, fields=("date", "deaths", "rolling_average"))[1] == 1
+
+
+def test_ca_new_day_matches_full_rebuild():
+    previous = _ca_full(_ca_rows(100))
+    rows = _ca_rows(101)
+    assert _ca_spliced(rows, previous) == _ca_full(rows)
+
+
+def test_ca_revision_matches_full_rebuild():
+    previous = _ca_full(_ca_rows(100))
+    rows = _ca_rows(101)
+    # Revised within the look-back window, so every later cumulative value shifts
+    rows[90]["deaths"] += 5
+    rows[95]["deaths"] = 0
+
+    spliced = _ca_spliced(rows, previous)
+
+    assert spliced == _ca_full(rows)
+    assert spliced[-1]["cumulative_deaths"] == previous[-1]["cumulative_deaths"] + 5 - (95 % 11) + (100 % 11)
+
+
+def test_ca_revision_without_new_day_matches_full_rebuild():
+    previous = _ca_full(_ca_rows(100))
+    rows = _ca_rows(100)
+    rows[-2]["deaths"] += 1
+
+    spliced = _ca_spliced(rows, previous)
+
+    assert spliced == _ca_full(rows)
+    assert spliced[-1]["date"] == previous[-1]["date"]
+    assert incremental.digest(spliced, ca.EPI_SOURCE["splice_fields"]) != incremental.digest(previous, ca.EPI_SOURCE["splice_fields"])
+
+
+def test_ca_undated_revision_matches_full_rebuild():
+    previous = _ca_full(_ca_rows(100, undated=3))
+    # The undated deaths come before every day, so nothing can be reused
+    rows = _ca_rows(101, undated=4)
+    assert _ca_spliced(rows, previous) == _ca_full(rows)
+
+
+def test_ca_undated_deaths_appear_matches_full_rebuild():
+    previous = _ca_full(_ca_rows(100, undated=0))
+    rows = _ca_rows(101, undated=2)
+    assert _ca_spliced(rows, previous) == _ca_full(rows)
+
+
+def test_wa_revised_rolling_average_matches_full_rebuild():
+    def rows(days):
+        return [{"date": _day(i), "deaths": i % 7, "rolling_average": (i % 7) / 7} for i in range(days)]
+
+    def full(rows):
+        return engine.derive_cumulative(wa._epi_series(copy.deepcopy(rows)))
+
+    previous = full(rows(100))
+    revised = rows(100)
+    revised[-3]["rolling_average"] = 9.0
+
+    spliced = engine.derive_cumulative(wa._epi_series(_tail(revised, previous), _published(previous)))
+
+    assert spliced == full(revised)
+    assert spliced[-3]["rolling_average"] == 9.0
+
+
+def test_digest_only_changes_with_the_fields():
+    records = [{"date": _day(i), "deaths": i, "cumulative_deaths": i} for i in range(5)]
+    derived = [dict(r, cumulative_deaths=0) for r in records]
+    revised = [dict(r) for r in records]
+    revised[2]["deaths"] = 10
+
+    fields = ("date", "deaths")
+    assert incremental.digest(records, fields) == incremental.digest(derived, fields)
+    assert incremental.digest(records, fields) != incremental.digest(revised, fields)
+
+
+def test_previous_loader_loads_on_first_call_only(monkeypatch):
+    loads = []
+
+    def load_previous_series(section):
+        loads.append(section)
+        return [{"date": _day(0), "deaths": 0}]
+    monkeypatch.setattr(incremental, "load_previous_series", load_previous_series)
+
+    load = incremental.previous_loader({"url": "unused"})
+    since = incremental.lazy_cutoff(load, LOOKBACK_DAYS)
+    assert loads == []
+
+    assert since() == dates.add_days(_day(0), -LOOKBACK_DAYS)
+    load()
+    assert len(loads) == 1
+
+
+def test_lazy_cutoff_without_previous_series():
+    assert incremental.lazy_cutoff(None, LOOKBACK_DAYS) is None
+    assert incremental.lazy_cutoff(lambda: None, LOOKBACK_DAYS)() is None
+
+
+def test_read_records_resolves_cutoff_at_the_first_row():
+    # An unchanged source yields no rows, so the previous series is never loaded
+    class Unchanged:
+        unchanged = True
+
+        def content(self):
+            return None
+
+    calls = []
+    assert list(engine.read_records(wa.EPI_SOURCE, fetch=Unchanged(), since=lambda: calls.append(1))) == []
+    assert calls == []
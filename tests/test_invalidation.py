@@ -0,0 +1,66 @@
+from beyblade_lambda import invalidation
+from beyblade_lambda.invalidation import InvalidationCollector, coalesce_paths
+
+
+def _covered(path, result):
+    return any(path == p or (p.endswith("/*") and path.startswith(p[:-1])) for p in result)
+
+
+def test_few_paths_are_kept():
+    paths = ["/static/data/ca/metadata.json", "/static/data/wa/metadata.json"]
+    assert coalesce_paths(paths) == sorted(paths)
+
+
+def test_crowded_directory_becomes_wildcard():
+    paths = [f"/static/data/ca/{name}.json" for name in ("metadata", "epi", "breakthrough")]
+    paths.append("/index.html")
+    assert coalesce_paths(paths) == ["/index.html", "/static/data/ca/*"]
+
+
+def test_wildcard_drops_the_paths_it_covers():
+    paths = [f"/static/data/{name}.json" for name in ("a", "b", "c")] + ["/static/data/ca/metadata.json"]
+    assert coalesce_paths(paths) == ["/static/data/*"]
+
+
+def test_max_paths_collapses_the_most_crowded_directories():
+    paths = [f"/static/data/{state}/{name}.json" for state in ("ca", "wa", "or") for name in ("a", "b")]
+    paths += [f"/static/reports/{i}/report.pdf" for i in range(20)]
+
+    result = coalesce_paths(paths, max_paths=5)
+
+    assert len(result) <= 5
+    assert all(_covered(path, result) for path in paths)
+
+
+def test_max_paths_falls_back_to_everything():
+    paths = [f"/{i}/{j}/x.json" for i in range(10) for j in range(2)]
+    assert coalesce_paths(paths, min_paths=10, max_paths=1) == ["/*"]
+
+
+def test_collector_sends_one_coalesced_invalidation():
+    class Storage:
+        def __init__(self):
+            self.invalidations = []
+
+        def invalidate(self, paths):
+            self.invalidations.append(paths)
+            return {"Invalidation": {"Id": "I1"}}
+
+    storage = Storage()
+    collector = InvalidationCollector()
+    collector.add([f"/static/data/ca/{name}.json" for name in ("a", "b")])
+    collector.add(["/static/data/ca/c.json", "/index.html"])
+
+    report = collector.flush(storage=storage)
+
+    assert storage.invalidations == [["/index.html", "/static/data/ca/*"]]
+    assert report["requested_paths"] == 4
+    assert report["invalidation_id"] == "I1"
+    assert collector.paths == []
+    assert collector.flush(storage=storage)["invalidation_id"] is None
+    assert len(storage.invalidations) == 1
+
+
+def test_defaults_fit_cloudfront_limits():
+    paths = [f"/static/reports/{i}/{j}.pdf" for i in range(100) for j in range(2)]
+    assert len(coalesce_paths(paths)) <= invalidation.MAX_INVALIDATION_PATHS
@@ -0,0 +1,101 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+from beyblade_lambda import bench, metrics, runner
+
+
+@pytest.fixture
+def sink():
+    previous = metrics.get_recorder()
+    sink = metrics.MemorySink()
+    metrics.set_recorder(metrics.Recorder(sink))
+    try:
+        yield sink
+    finally:
+        metrics.set_recorder(previous)
+
+
+def _stages(documents):
+    return {(d["State"], d["Source"], d["Stage"]): d for d in documents}
+
+
+def test_values_outside_of_a_scope_are_dropped(sink):
+    metrics.add("parse", RowsScanned=1)
+    with metrics.timer("parse"):
+        pass
+    assert metrics.get_recorder().flush() == []
+
+
+def test_flush_writes_one_document_per_stage(sink):
+    with metrics.scope("ca", "epi"):
+        metrics.add("parse", RowsScanned=2, RowsKept=1)
+        metrics.add("parse", RowsScanned=3)
+        metrics.add("fetch", BytesIn=10)
+
+    documents = metrics.get_recorder().flush(timestamp=1)
+
+    assert documents == sink.documents
+    assert [d["Stage"] for d in documents] == ["fetch", "parse"]
+    parse = documents[1]
+    assert (parse["State"], parse["Source"], parse["RowsScanned"], parse["RowsKept"]) == ("ca", "epi", 5, 1)
+    emf = parse["_aws"]
+    assert emf["Timestamp"] == 1000
+    assert emf["CloudWatchMetrics"][0]["Dimensions"] == [metrics.DIMENSIONS]
+    assert [m["Name"] for m in emf["CloudWatchMetrics"][0]["Metrics"]] == ["RowsKept", "RowsScanned"]
+    assert metrics.get_recorder().flush() == []
+
+
+def test_nested_timers_are_exclusive(sink):
+    with metrics.scope("ca", "epi"):
+        with metrics.timer("total", exclusive=False), metrics.timer("parse"):
+            with metrics.timer("fetch"):
+                time.sleep(0.05)
+            # Time the parser spent waiting on an upload it measured itself
+            time.sleep(0.02)
+            metrics.add_time("upload", 0.02)
+
+    stages = _stages(metrics.get_recorder().flush())
+
+    assert stages["ca", "epi", "fetch"]["Duration"] >= 50
+    assert stages["ca", "epi", "upload"]["Duration"] == 20
+    assert 0 <= stages["ca", "epi", "parse"]["Duration"] < 20
+    assert stages["ca", "epi", "total"]["Duration"] >= 70
+
+
+def test_scope_follows_the_context_into_threads(sink):
+    def work():
+        metrics.add("upload", Uploads=1)
+
+    with metrics.scope("wa", "epi"):
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(work,))
+        thread.start()
+        thread.join()
+    # A plain thread starts outside of any scope
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+
+    assert list(_stages(metrics.get_recorder().flush())) == [("wa", "epi", "upload")]
+
+
+def test_unchanged_run_records_cache_hits_only(sink, tmp_path, capsys):
+    bench.synthesize_fixtures(str(tmp_path), scale=1)
+    fixtures = bench.load_fixtures(str(tmp_path))
+    with bench.replay_sources(fixtures), bench.local_storage(fixtures):
+        runner.main()
+        cold = _stages(sink.documents)
+        sink.documents.clear()
+        runner.main()
+        warm = _stages(sink.documents)
+
+    for state in runner.STATES:
+        for source in ("epi", "breakthrough"):
+            assert cold[state, source, "fetch"]["BytesIn"] > 0
+            assert cold[state, source, "upload"]["Uploads"] > 0
+            assert (warm[state, source, "fetch"]["BytesIn"], warm[state, source, "fetch"]["CacheHits"]) == (0, 1)
+            # Every source answered 304, so nothing was loaded, derived or uploaded
+            assert {stage for s, src, stage in warm if (s, src) == (state, source)} <= {"fetch", "parse"}
+    assert warm["all", "cloudfront", "invalidation"]["Paths"] == 0
@@ -0,0 +1,96 @@
+import io
+import re
+
+import PyPDF2 as pypdf
+import pytest
+
+from beyblade_lambda import bench, wa_constants
+from beyblade_lambda.exceptions import ParseError
+from beyblade_lambda.pdf import FieldExtractor
+
+
+FIELDS = wa_constants.BREAKTHROUGH_FIELDS
+REQUIRED = wa_constants.BREAKTHROUGH_REQUIRED_FIELDS
+HEADER = "Washington State Department of Health June 2, 2021"
+GLANCE = "At a Glance (data from January 17, 2021 - May 22, 2021)"
+CASES = "So far, 3,450 SARS-CoV-2 vaccine breakthrough cases have been identified"
+HOSPITALIZED = "Of these, 7% were hospitalized"
+
+
+def _extract(pages):
+    return FieldExtractor(FIELDS, required=REQUIRED).extract(bench._pdf_bytes(pages))
+
+
+def _greedy(pdf_bytes):
+    # How the reports were parsed before FieldExtractor: every page's text joined and matched
+    # against ".*<pattern>.*"
+    reader = pypdf.PdfFileReader(io.BytesIO(pdf_bytes))
+    text = "".join(reader.getPage(p).extractText() for p in range(reader.numPages)).replace("\n", "")
+    matches = {name: re.match(f".*{pattern.pattern}.*", text) for name, pattern in FIELDS.items()}
+    return {name: match.groups() for name, match in matches.items() if match}
+
+
+def _assert_greedy_parity(pdf_bytes):
+    found, _, _ = FieldExtractor(FIELDS, required=REQUIRED).extract(pdf_bytes)
+    greedy = _greedy(pdf_bytes)
+    assert found == {name: greedy[name] for name in found}
+    # The preferred field of every group is used whenever the whole text has it
+    for group in REQUIRED:
+        assert next(name for name in group if name in greedy) in found
+
+
+def test_matches_greedy_patterns_on_the_archived_reports():
+    for i in range(6):
+        _assert_greedy_parity(bench._synthetic_wa_report(i)[1])
+
+
+def test_repeated_fields_take_the_last_occurrence():
+    pages = [
+        f"{HEADER}\n{GLANCE}\n{CASES}\n{HOSPITALIZED}\nand 40 people died of COVID-related illness",
+        "Washington State Department of Health June 9, 2021\nand 41 people died of COVID-related illness",
+        "Table 1: breakthrough cases by county",
+    ]
+    found, pages_found, _ = _extract(pages)
+
+    assert found["report_date"] == ("June 9, 2021",)
+    assert found["death_count"] == ("41",)
+    assert pages_found["death_count"] == 1
+    _assert_greedy_parity(bench._pdf_bytes(pages))
+
+
+def test_field_split_across_pages_is_on_the_page_it_starts():
+    pages = [
+        f"{HEADER}\n{GLANCE}\n{CASES}\n{HOSPITALIZED}",
+        "Table 1\nand 40 people died of COVID-",
+        "related illness\nTable 2",
+    ]
+    found, pages_found, _ = _extract(pages)
+
+    assert found["death_count"] == ("40",)
+    assert pages_found["death_count"] == 1
+    _assert_greedy_parity(bench._pdf_bytes(pages))
+
+
+def test_preferred_field_wins_over_a_later_fallback():
+    pages = [
+        f"{HEADER}\n{GLANCE}\n{CASES}\n{HOSPITALIZED}\nand 40 people died of COVID-related illness",
+        "Of the breakthrough cases 1.2% died of COVID-related illness",
+    ]
+    found, _, pages_read = _extract(pages)
+
+    assert found["death_count"] == ("40",)
+    assert pages_read == 2
+    _assert_greedy_parity(bench._pdf_bytes(pages))
+
+
+def test_reading_stops_once_every_field_is_found():
+    summary = f"{HEADER}\n{GLANCE}\n{CASES}\n{HOSPITALIZED}\nand 40 people died of COVID-related illness"
+    found, pages_found, pages_read = _extract(["Table 1", "Table 2", summary])
+
+    assert pages_read == 1
+    assert set(pages_found.values()) == {2}
+
+
+def test_missing_fields_raise():
+    with pytest.raises(ParseError, match="hospitalized_pct"):
+        _extract([f"{HEADER}\n{GLANCE}\n{CASES}\nand 40 people died of COVID-related illness"])
@@ -0,0 +1,44 @@
+import pytest
+
+from beyblade_lambda import bench, storage, wa
+from beyblade_lambda.exceptions import ParseError
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    local = storage.set_storage(storage.LocalStorage(str(tmp_path)))
+    try:
+        yield local
+    finally:
+        storage.set_storage(None)
+
+
+def _archive(bucket, reports):
+    prefix = wa.CONFIG.get_breakthrough_data_prefix().rstrip("/")
+    keys = []
+    for fname, content in reports:
+        keys.append(f"{prefix}/{fname}")
+        bucket.put(keys[-1], content, "application/pdf")
+    return keys
+
+
+def test_rebuild_reprocesses_every_report(bucket):
+    keys = _archive(bucket, [bench._synthetic_wa_report(i) for i in range(3)])
+
+    manifest = wa.REPORTS.rebuild_manifest(force_refresh=True)
+
+    assert sorted(manifest["reports"]) == keys
+    assert [r["death_count"] for r in manifest["reports"].values()] == [40, 46, 52]
+    assert wa.REPORTS.get_manifest() == manifest
+    assert all(bucket.get(wa.REPORTS.record_key(key)) is not None for key in keys)
+
+
+def test_rebuild_never_publishes_a_manifest_missing_reports(bucket, capsys):
+    reports = [bench._synthetic_wa_report(i) for i in range(2)]
+    keys = _archive(bucket, reports + [("2021-07-01-420-339-VaccineBreakthroughReport.pdf", b"not a pdf")])
+
+    with pytest.raises(ParseError, match=keys[-1]):
+        wa.REPORTS.rebuild_manifest(force_refresh=True)
+
+    assert wa.REPORTS.get_manifest() is None
+    assert "'ok': False" in capsys.readouterr().out
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from beyblade_lambda import storage, uploads
+from beyblade_lambda.uploads import QueuedStorage
+
+
+class Recording(storage.LocalStorage):
+    # Records the order puts finish in. A put of a key in `gates` waits for the gate to be set,
+    # and a key in `failing` raises.
+    def __init__(self, root, delay=0.0):
+        super().__init__(root)
+        self.order = []
+        self.gates = {}
+        self.failing = set()
+        self.delay = delay
+
+    def put(self, key, body, content_type, **extra):
+        if key in self.gates:
+            assert self.gates[key].wait(5)
+        time.sleep(self.delay)
+        if key in self.failing:
+            raise RuntimeError(f"Failed to upload {key}")
+        super().put(key, body, content_type, **extra)
+        self.order.append(key)
+
+    def invalidate(self, paths):
+        self.order.append("INVALIDATE")
+        return super().invalidate(paths)
+
+
+@pytest.fixture
+def recording(tmp_path):
+    return Recording(str(tmp_path))
+
+
+@pytest.fixture
+def queued(recording):
+    # write_behind over `recording`, so barrier() finds the queue through get_storage()
+    storage.set_storage(recording)
+    try:
+        with uploads.write_behind(max_workers=4) as queue:
+            yield queue
+    finally:
+        storage.set_storage(None)
+
+
+def test_duplicate_and_superseded_writes(recording):
+    queue = QueuedStorage(recording, max_workers=1)
+    recording.gates["busy"] = threading.Event()
+    queue.put("busy", b"x", "text/plain")
+    queue.put("a", b"1", "text/plain")
+    queue.put("a", b"1", "text/plain")
+    queue.put("b", b"1", "text/plain")
+    queue.put("b", b"2", "text/plain")
+
+    recording.gates["busy"].set()
+    queue.close()
+
+    assert recording.order == ["busy", "a", "b"]
+    assert recording.get("b") == b"2"
+    report = queue.report()
+    assert (report["Uploads"], report["Deduplicated"], report["Superseded"]) == (3, 1, 1)
+    assert report["BytesOut"] == 3
+
+
+def test_reads_see_queued_writes(recording):
+    queue = QueuedStorage(recording, max_workers=1)
+    recording.gates["a"] = threading.Event()
+    queue.put("a", b"queued", "text/plain")
+
+    assert recording.get("a") is None
+    assert queue.get("a") == b"queued"
+    assert queue.head("a")["Size"] == 6
+    status, body, etag = queue.get_conditional("a")
+    assert (status, body) == (200, b"queued")
+    assert queue.get_conditional("a", etag) == (304, None, etag)
+
+    recording.gates["a"].set()
+    queue.close()
+    assert queue.get("a") == b"queued"
+    assert queue.head("a")["ETag"] == etag
+
+
+def test_barrier_orders_metadata_after_data(queued, recording):
+    recording.delay = 0.01
+    with uploads.owner("ca"):
+        for i in range(8):
+            queued.put(f"ca/data-{i}.json", b"{}", "application/json")
+        uploads.barrier()
+        queued.put("ca/metadata.json", b"{}", "application/json")
+
+    queued.invalidate(["/ca/*"])
+
+    assert recording.order[-2:] == ["ca/metadata.json", "INVALIDATE"]
+    assert sorted(recording.order[:-2]) == [f"ca/data-{i}.json" for i in range(8)]
+
+
+def test_barrier_only_waits_for_its_owner(queued, recording):
+    recording.gates["ca/slow.json"] = threading.Event()
+    with uploads.owner("ca"):
+        queued.put("ca/slow.json", b"{}", "application/json")
+    with uploads.owner("wa"):
+        queued.put("wa/data.json", b"{}", "application/json")
+        uploads.barrier()
+
+    assert recording.order == ["wa/data.json"]
+    recording.gates["ca/slow.json"].set()
+    with uploads.owner("ca"):
+        uploads.barrier()
+    assert recording.order == ["wa/data.json", "ca/slow.json"]
+
+
+def test_failure_is_raised_to_its_owner(queued, recording):
+    recording.failing.add("ca/data.json")
+    with uploads.owner("ca"):
+        queued.put("ca/data.json", b"{}", "application/json")
+    with uploads.owner("wa"):
+        queued.put("wa/data.json", b"{}", "application/json")
+        uploads.barrier()
+        assert list(queued.list("wa/")) != []
+
+    with uploads.owner("ca"), pytest.raises(RuntimeError):
+        uploads.barrier()
+    assert queued.report()["Failed"] == 1
+
+
+def test_owner_follows_the_context_not_the_thread(queued, recording):
+    # Pool threads are reused between states; the owner comes with the context a state's work runs in
+    def run(state):
+        with uploads.owner(state):
+            queued.put(f"{state}/data.json", b"{}", "application/json")
+            uploads.barrier()
+            return recording.get(f"{state}/data.json")
+
+    recording.gates["ca/data.json"] = threading.Event()
+    thread = threading.Thread(target=run, args=("ca",))
+    thread.start()
+    assert run("wa") == b"{}"
+    assert thread.is_alive()
+
+    recording.gates["ca/data.json"].set()
+    thread.join(5)
+    assert recording.order == ["wa/data.json", "ca/data.json"]
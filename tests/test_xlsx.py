@@ -0,0 +1,95 @@
+import io
+
+from datetime import datetime, timedelta
+
+import openpyxl
+import pytest
+
+from beyblade_lambda import bench, engine, wa_constants
+from beyblade_lambda.exceptions import ParseError
+from beyblade_lambda.xlsx import read_sheet_records
+
+
+SPEC = {
+    "sheet": "Deaths",
+    "columns": {"Date": "date", "County": "county", "Deaths": "deaths", "Average": "rolling_average"},
+    "filters": {"county": "Statewide"},
+}
+
+
+def _streamed(content, spec):
+    return list(read_sheet_records(
+        content, spec["sheet"], spec["columns"], filters=spec.get("filters"), date_fields=("date",)
+    ))
+
+
+def _workbook(rows, epoch=None):
+    workbook = openpyxl.Workbook()
+    if epoch is not None:
+        workbook.epoch = epoch
+    workbook.active.title = "Notes"
+    workbook.active.append(["Not the sheet you are looking for"])
+    sheet = workbook.create_sheet("Deaths")
+    for row in rows:
+        sheet.append(row)
+    out = io.BytesIO()
+    workbook.save(out)
+    return out.getvalue()
+
+
+def _rows(days):
+    start = datetime(2021, 3, 1)
+    rows = [["Deaths by county"], [], ["Extra", "Date", "County", "Deaths", "Average", "Notes"]]
+    for i in range(days):
+        for county in ("Statewide", "King"):
+            rows.append(["x", start + timedelta(days=i), county, i, i / 7 if i % 3 else None, "note" if i % 2 else None])
+    rows.append([None, None, "Statewide", 1, 0.5])
+    return rows
+
+
+def test_matches_openpyxl_on_the_wa_fixture():
+    content = bench._synthetic_wa_epi(90)
+    spec = dict(wa_constants.EPI_SOURCE)
+    assert _streamed(content, spec) == engine._read_xlsx_openpyxl(content, spec)
+    assert len(_streamed(content, spec)) == 90
+
+
+@pytest.mark.parametrize("filters", [SPEC["filters"], None])
+def test_matches_openpyxl(filters):
+    content = _workbook(_rows(40))
+    spec = dict(SPEC, filters=filters)
+
+    streamed = _streamed(content, spec)
+
+    assert streamed == engine._read_xlsx_openpyxl(content, spec)
+    assert len(streamed) == (41 if filters else 81)
+    assert streamed[0] == {"date": datetime(2021, 3, 1), "county": "Statewide", "deaths": 0, "rolling_average": None}
+    assert streamed[-1] == {"date": None, "county": "Statewide", "deaths": 1, "rolling_average": 0.5}
+
+
+def test_matches_openpyxl_with_1904_dates():
+    content = _workbook(_rows(5), epoch=openpyxl.utils.datetime.CALENDAR_MAC_1904)
+    streamed = _streamed(content, SPEC)
+    assert streamed == engine._read_xlsx_openpyxl(content, SPEC)
+    assert streamed[0]["date"] == datetime(2021, 3, 1)
+
+
+def test_read_xlsx_uses_the_streaming_reader(monkeypatch):
+    class Fetch:
+        def content(self):
+            return _workbook(_rows(5))
+
+    def openpyxl_reader(content, spec):
+        raise AssertionError("openpyxl should only be a fallback")
+    monkeypatch.setattr(engine, "_read_xlsx_openpyxl", openpyxl_reader)
+
+    records = engine._read_xlsx(dict(SPEC, url="https://source.test/deaths.xlsx", date_field="date"), Fetch())
+    assert len(records) == 6
+
+
+def test_missing_header_raises():
+    content = _workbook([["Something else"], [datetime(2021, 3, 1)]])
+    with pytest.raises(ParseError):
+        _streamed(content, SPEC)
+    with pytest.raises(ParseError):
+        _streamed(content, dict(SPEC, sheet="Missing"))